@@ -0,0 +1,75 @@
+"""
+Benchmark the streaming BLS directory index parser used by the ingest
+Lambda against the BeautifulSoup implementation it replaced.
+
+Run from the repository root:
+
+    python benchmarks/bench_listing_parser.py [entries]
+"""
+import os
+import sys
+import timeit
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lambda_fns.ingest import handler  # noqa: E402
+
+
+def build_index(entries):
+    """Build a synthetic index page in the format served by download.bls.gov"""
+    rows = [
+        f' 7/31/2025  8:30 AM {1000 + i:>12} '
+        f'<A HREF="/pub/time.series/pr/pr.data.{i}.Series">pr.data.{i}.Series</A><br>'
+        for i in range(entries)
+    ]
+    page = (
+        '<html><head><title>download.bls.gov - /pub/time.series/pr/</title></head><body>'
+        '<H1>download.bls.gov - /pub/time.series/pr/</H1><hr>\n<pre>'
+        '<A HREF="/pub/time.series/">[To Parent Directory]</A><br><br>'
+        + "".join(rows) + '</pre><hr></body></html>'
+    )
+    return page.encode("utf-8")
+
+
+def parse_with_bs4(body):
+    """The BeautifulSoup-based fetch_remote_files parsing this benchmark replaces"""
+    soup = BeautifulSoup(body.decode("utf-8"), "html.parser")
+    files = {}
+    for link in soup.find_all("a", href=True):
+        href = link['href']
+        if not href.endswith("/") and not href.startswith("?"):
+            preceding = link.previous_sibling
+            size, mtime = handler.parse_listing_entry(preceding if isinstance(preceding, str) else "")
+            files[href.split("/")[-1].strip()] = {
+                "url": urljoin(handler.BLS_URL, href), "size": size, "mtime": mtime
+            }
+    return files
+
+
+def parse_streaming(body):
+    """The parsing done by fetch_remote_files, fed in download-sized chunks"""
+    chunks = (body[i:i + handler.CHUNK_SIZE] for i in range(0, len(body), handler.CHUNK_SIZE))
+    files = {}
+    for href, size, mtime in handler.iter_listing(chunks):
+        if not href.endswith("/") and not href.startswith("?"):
+            files[href.split("/")[-1].strip()] = {
+                "url": urljoin(handler.BLS_URL, href), "size": size, "mtime": mtime
+            }
+    return files
+
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    body = build_index(entries)
+    assert parse_with_bs4(body) == parse_streaming(body)
+
+    for name, parse in (("bs4 html.parser", parse_with_bs4), ("streaming HTMLParser", parse_streaming)):
+        runs = 20
+        seconds = min(timeit.repeat(lambda: parse(body), number=runs, repeat=3)) / runs
+        print(f"{name:<22} {entries} entries: {seconds * 1000:8.2f} ms per parse")
+
+
+if __name__ == "__main__":
+    main()
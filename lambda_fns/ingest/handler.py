@@ -1,17 +1,41 @@
 import os
+import base64
 import boto3
+import codecs
+import gzip
 import json
+import random
 import requests
+import threading
+from botocore.exceptions import ClientError
+from requests.adapters import HTTPAdapter
 import hashlib
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin
+import heapq
+import importlib
+import io
+import re
+import time
+import uuid
+import zlib
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from fnmatch import fnmatch
+from functools import lru_cache
+from itertools import islice
+from html.parser import HTMLParser
+from urllib.parse import urlencode, urljoin, urlparse
+from zoneinfo import ZoneInfo
 
 # Initialize boto3 S3 client
 s3 = boto3.client("s3")
 
 # Environment variables and constants
 BUCKET = os.environ.get("BUCKET_NAME")
-BLS_URL = "https://download.bls.gov/pub/time.series/pr/"
+BLS_SERIES_URL = "https://download.bls.gov/pub/time.series/"
+BLS_URL = BLS_SERIES_URL + "pr/"
 POP_URL = "https://honolulu-api.datausa.io/tesseract/data.jsonrecords?cube=acs_yg_total_population_1&drilldowns=Year%2CNation&locale=en&measures=Population"
 BLS_PREFIX = "bls-data/"
 POP_S3_KEY = "datausa/acs_population.json"
@@ -19,104 +43,2135 @@ HEADERS = {
     "User-Agent": "Pipeline/1.0 (contact: stackjerry@google.com)"
 }
 
-def sync_bls():
-    """
-    Sync BLS files from the remote HTTP server to S3 bucket,
-    uploading new or changed files, and deleting removed files.
-    """
-    try:
-        def list_s3_objects(bucket, prefix=""):
-            paginator = s3.get_paginator("list_objects_v2")
-            keys = {}
-            for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
-                for obj in page.get("Contents", []):
-                    keys[obj["Key"]] = obj["ETag"].strip('"')
-            return keys
-
-        def get_md5(content):
-            return hashlib.md5(content).hexdigest()
-
-        def fetch_remote_files():
-            resp = requests.get(BLS_URL, headers=HEADERS)
-            resp.raise_for_status()
-            soup = BeautifulSoup(resp.text, "html.parser")
-            files = {}
-            for link in soup.find_all("a", href=True):
-                href = link['href']
-                if not href.endswith("/") and not href.startswith("?"):
-                    full_url = urljoin(BLS_URL, href)
-                    fname = href.split("/")[-1].strip()
-                    files[fname] = full_url
-            return files
-
-        def upload_file_to_s3(filename, url):
-            print(f"Uploading: {filename}")
-            r = requests.get(url, headers=HEADERS)
-            r.raise_for_status()
-            s3.put_object(Bucket=BUCKET, Key=BLS_PREFIX + filename, Body=r.content)
-
-        print("Checking current S3 bucket state...")
-        s3_files = list_s3_objects(BUCKET, BLS_PREFIX)
-
-        print("Fetching file list from BLS...")
-        remote_files = fetch_remote_files()
-
-        if not s3_files:
-            print("S3 is empty — uploading all files.")
-            for fname, url in remote_files.items():
-                upload_file_to_s3(fname, url)
+# S3 user metadata holding the canonical hash of the population data, used
+# to skip uploads (and the report run they trigger) when nothing changed
+CONTENT_HASH_METADATA = "content-sha256"
+
+# Additional population drilldowns (e.g. "State,County") loaded alongside
+# the nation-level JSON the report reads. Each is fetched POP_PAGE_SIZE
+# records at a time, up to POP_PREFETCH_PAGES pages ahead, and streamed to
+# POP_NDJSON_PREFIX<geography>.ndjson as newline-delimited JSON.
+POP_API_URL = "https://honolulu-api.datausa.io/tesseract/data.jsonrecords"
+POP_CUBE = "acs_yg_total_population_1"
+POP_GEOGRAPHIES = [g.strip() for g in os.environ.get("POP_GEOGRAPHIES", "").split(",") if g.strip()]
+POP_PAGE_SIZE = int(os.environ.get("POP_PAGE_SIZE", "50000"))
+POP_PREFETCH_PAGES = int(os.environ.get("POP_PREFETCH_PAGES", "2"))
+POP_NDJSON_PREFIX = "datausa/population/"
+
+# Stale-while-revalidate cache of the nation-level population response,
+# kept in memory and in S3 with the response's validators. A copy younger
+# than POP_CACHE_TTL_SECONDS is used without a request; an older one is
+# revalidated with a conditional GET, and if that takes more than
+# POP_REFRESH_WAIT_SECONDS or fails, the cached copy is used while the
+# refresh finishes in the background or on the next run.
+POP_CACHE_KEY = "_cache/datausa/acs_population.json"
+POP_CACHE_TTL_SECONDS = float(os.environ.get("POP_CACHE_TTL_SECONDS", "3600"))
+POP_REFRESH_WAIT_SECONDS = float(os.environ.get("POP_REFRESH_WAIT_SECONDS", "10"))
+POP_TIMEOUT = (3.05, float(os.environ.get("POP_READ_TIMEOUT_SECONDS", "20")))
+
+# Parquet mode: keep typed, compressed Parquet copies of the raw objects
+# readers parse, under PARQUET_PREFIX<raw key>.parquet (outside the mirrored
+# prefixes, so syncs never treat them as stale). Needs pandas and pyarrow
+# from the AWS SDK pandas layer; without them Parquet mode is skipped.
+PARQUET = os.environ.get("PARQUET", "false").lower() == "true"
+PARQUET_PREFIX = "parquet/"
+PARQUET_BLS_FILES = [p.strip() for p in os.environ.get("PARQUET_BLS_FILES", "pr.data.0.Current").split(",") if p.strip()]
+
+# Typed columns of BLS time-series files; every other column is a string
+BLS_COLUMN_DTYPES = {"year": "int32", "value": "float64"}
+
+# Number of BLS files transferred concurrently by sync_bls
+SYNC_WORKERS = int(os.environ.get("SYNC_WORKERS", "8"))
+
+# Registry of BLS time-series directories mirrored by sync_bls: either a
+# comma-separated list of survey codes, each mirrored from
+# BLS_SERIES_URL/<code>/ to bls-data/<code>/, or a JSON list of dataset
+# objects (see load_datasets). "pr" keeps its original place directly under
+# BLS_PREFIX, where the report reads it.
+BLS_DATASETS = os.environ.get("BLS_DATASETS", "pr")
+
+# Number of datasets synced at once. Their downloads still share the BLS
+# host's AdaptiveLimiter and the pooled HTTP session.
+DATASET_WORKERS = int(os.environ.get("DATASET_WORKERS", "4"))
+
+# Fan-out mode: with a work queue configured, a dataset with at least
+# FANOUT_MIN_FILES files to sync is split into up to SYNC_SHARDS shards of
+# similar total size, each transferred by a separate worker invocation.
+SYNC_QUEUE_URL = os.environ.get("SYNC_QUEUE_URL")
+SYNC_SHARDS = int(os.environ.get("SYNC_SHARDS", "8"))
+FANOUT_MIN_FILES = int(os.environ.get("FANOUT_MIN_FILES", "50"))
+
+# Snapshot mode: after each sync, store every distinct file body once under
+# SNAPSHOT_PREFIX/objects/<sha256> and write a per-run snapshot manifest
+# mapping file names to those hashes, so history costs only what changed.
+SNAPSHOTS = os.environ.get("SNAPSHOTS", "false").lower() == "true"
+SNAPSHOT_PREFIX = os.environ.get("SNAPSHOT_PREFIX", "bls-snapshots/")
+
+# SendMessageBatch accepts at most 10 messages per request
+SQS_BATCH_SIZE = 10
+
+# Pooled HTTP client settings: keep-alive connections per origin host, and
+# explicit (connect, read) timeouts so a stalled origin cannot hang the run
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", str(max(10, SYNC_WORKERS))))
+HTTP_TIMEOUT = (
+    float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5")),
+    float(os.environ.get("HTTP_READ_TIMEOUT", "60")),
+)
+
+# Origin throttling handling: 403/429 halve the allowed concurrency and are
+# retried like server errors, with jittered exponential backoff or the
+# server's Retry-After. Healthy responses (first byte within
+# HTTP_SLOW_SECONDS) raise the allowed concurrency additively.
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "4"))
+HTTP_BACKOFF_SECONDS = float(os.environ.get("HTTP_BACKOFF_SECONDS", "1"))
+HTTP_MAX_BACKOFF_SECONDS = float(os.environ.get("HTTP_MAX_BACKOFF_SECONDS", "30"))
+HTTP_SLOW_SECONDS = float(os.environ.get("HTTP_SLOW_SECONDS", "5"))
+THROTTLE_STATUSES = {403, 429}
+RETRY_STATUSES = {500, 502, 503, 504}
+
+# Request hedging: if a streamed GET has not returned its first byte within
+# the HEDGE_PERCENTILE of the host's recent first-byte latencies, a duplicate
+# is sent and whichever answers first is used. 0 disables hedging;
+# HEDGE_MAX_RATIO caps the share of a host's requests that may be duplicated.
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "0"))
+HEDGE_MAX_RATIO = float(os.environ.get("HEDGE_MAX_RATIO", "0.05"))
+HEDGE_MIN_SAMPLES = 20
+
+# How sync_bls decides whether an existing S3 copy is stale:
+#   "conditional" - revalidate every file against the origin with a conditional GET
+#   "listing"     - trust the size/date columns of the directory index and only
+#                   request files whose listing entry is newer than the S3 copy
+SYNC_MODE = os.environ.get("SYNC_MODE", "conditional")
+
+# Files are streamed to S3 in parts of this size (S3 requires at least 5 MiB
+# for every part but the last); at most one part is held in memory.
+PART_SIZE = max(5, int(os.environ.get("PART_SIZE_MB", "8"))) * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+# DeleteObjects accepts at most 1000 keys per request
+DELETE_BATCH_SIZE = 1000
+
+# Per-prefix sync manifest: the state of every mirrored file, read in one GET
+# instead of listing the prefix on every run. It lives outside BLS_PREFIX so
+# it is never mistaken for a mirrored file. Each dataset has its own.
+MANIFEST_KEY = f"_sync/{BLS_PREFIX.rstrip('/')}/manifest.json"
+MANIFEST_VERSION = 1
+
+# Hours between full-listing reconciliations of the manifest with S3
+RECONCILE_HOURS = float(os.environ.get("RECONCILE_HOURS", "168"))
+
+# Checkpoint of an unfinished sync, written when the Lambda is about to time
+# out so the next invocation carries on where this one stopped.
+CHECKPOINT_KEY = f"_sync/{BLS_PREFIX.rstrip('/')}/checkpoint.json"
+
+# Seconds of Lambda time reserved for finishing in-flight transfers and
+# writing the checkpoint; no new file is started after that point.
+CHECKPOINT_MARGIN_SECONDS = float(os.environ.get("CHECKPOINT_MARGIN_SECONDS", "60"))
+
+# Age after which a checkpoint found by a scheduled (not resumed) run is
+# discarded and every file is revalidated again. Kept well under the daily
+# schedule, so a resume chain that stopped early never hides a day's updates.
+CHECKPOINT_MAX_AGE_HOURS = float(os.environ.get("CHECKPOINT_MAX_AGE_HOURS", "12"))
+
+# Maximum number of times an unfinished sync re-invokes itself in a row
+MAX_RESUMES = int(os.environ.get("MAX_RESUMES", "10"))
+
+# Delta mode: when the directory index shows a file has grown, check that
+# the change is a pure append and fetch only the new bytes with an HTTP
+# Range request, copying the existing object server-side. The last
+# DELTA_CHECK_BYTES of the old content are compared to detect rewrites.
+DELTA_SYNC = os.environ.get("DELTA_SYNC", "false").lower() == "true"
+DELTA_CHECK_BYTES = 64 * 1024
+
+# S3 only accepts parts (including copied ones) of at least 5 MiB, except the last
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+# Compressed mode: ask the origin for gzip, keep the compressed bytes as they
+# arrive (compressing locally if the origin sends identity) and store them
+# with Content-Encoding: gzip. The report Lambda decompresses transparently.
+COMPRESS_BLS = os.environ.get("COMPRESS_BLS", "false").lower() == "true"
+
+# Crawler mode: follow subdirectories of each dataset's URL up to this many levels deep
+# (0 mirrors only the top-level directory), visiting at most CRAWL_MAX_DIRS
+# directories in total
+CRAWL_MAX_DEPTH = int(os.environ.get("CRAWL_MAX_DEPTH", "0"))
+CRAWL_MAX_DIRS = int(os.environ.get("CRAWL_MAX_DIRS", "100"))
+
+# Timezone of the timestamps printed in the BLS directory index
+BLS_TIMEZONE = os.environ.get("BLS_TIMEZONE", "America/New_York")
+
+# Matches the "7/31/2025  8:30 AM        583826 " text preceding each index link
+LISTING_ENTRY_RE = re.compile(
+    r"(\d{1,2})/(\d{1,2})/(\d{4})\s+(\d{1,2}):(\d{2})\s*([AP])M\s+(\d+|<dir>)\s*$",
+    re.IGNORECASE
+)
+
+def build_http_session():
+    """
+    Create the HTTP session shared by every request the ingest Lambda makes.
+    Each origin host gets a pool of up to HTTP_POOL_SIZE keep-alive
+    connections; callers block rather than open extra connections.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# Created at import so warm invocations of the same container reuse the
+# open TCP/TLS connections instead of paying a handshake per request
+http = build_http_session()
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for one origin host. Used as a context manager
+    around a unit of work; record() feeds it the outcome of each request:
+    "ok" adds 1/limit (about +1 per round of requests), "throttled" halves
+    the limit at most once per second, "slow" and "error" hold it.
+    """
+
+    def __init__(self, maximum, minimum=1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def record(self, outcome):
+        with self._cond:
+            if outcome == "ok":
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            elif outcome == "throttled":
+                now = time.monotonic()
+                if now - self._last_decrease >= 1:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._last_decrease = now
+            self._cond.notify_all()
+
+# One limiter per origin host, kept for the life of the container so warm
+# invocations start from the concurrency the origin last tolerated
+limiters = {}
+limiters_lock = threading.Lock()
+
+def origin_limiter(url):
+    host = urlparse(url).netloc
+    with limiters_lock:
+        if host not in limiters:
+            limiters[host] = AdaptiveLimiter(max(1, SYNC_WORKERS))
+        return limiters[host]
+
+def retry_delay(response, attempt):
+    """
+    Seconds to wait before retrying: the response's Retry-After if it has
+    one, otherwise full-jitter exponential backoff.
+    """
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(HTTP_MAX_BACKOFF_SECONDS, max(0.0, delay))
+    return random.uniform(0, min(HTTP_MAX_BACKOFF_SECONDS, HTTP_BACKOFF_SECONDS * 2 ** attempt))
+
+class LatencyTracker:
+    """
+    Rolling window of recent time-to-first-byte samples, plus the request
+    and hedge counts that enforce HEDGE_MAX_RATIO.
+    """
+
+    def __init__(self, window=500):
+        self.samples = deque(maxlen=window)
+        self.requests = 0
+        self.hedges = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def hedge_delay(self):
+        """
+        Seconds to wait before hedging a new request, or None if there are
+        too few samples to estimate the percentile.
+        """
+        with self._lock:
+            self.requests += 1
+            if len(self.samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE / 100))
+        return ordered[index]
+
+    def allow_hedge(self):
+        with self._lock:
+            if self.hedges + 1 > HEDGE_MAX_RATIO * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+# One tracker per origin host, like the limiters, so each host's requests
+# are hedged against that host's own latencies
+latency_trackers = {}
+latency_trackers_lock = threading.Lock()
+hedge_pool = ThreadPoolExecutor(max_workers=2 * HTTP_POOL_SIZE)
+
+def latency_tracker(url):
+    host = urlparse(url).netloc
+    with latency_trackers_lock:
+        if host not in latency_trackers:
+            latency_trackers[host] = LatencyTracker()
+        return latency_trackers[host]
+
+def timed_get(url, tracker, sent=None, **kwargs):
+    """
+    GET a streamed URL and record its time to first byte with tracker.
+    sent, if given, is set when the request actually leaves hedge_pool's
+    queue.
+    """
+    if sent is not None:
+        sent.set()
+    started = time.monotonic()
+    response = http.get(url, **kwargs)
+    tracker.record(time.monotonic() - started)
+    return response
+
+def close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+def hedged_get(url, **kwargs):
+    """
+    GET a URL, sending a second copy of the request if the first is slower
+    than the host's recent HEDGE_PERCENTILE latency and the hedge budget
+    allows. Only streamed requests are timed and hedged, since only their
+    latency is time to first byte. The losing response is closed as soon
+    as it arrives.
+    """
+    if HEDGE_PERCENTILE <= 0 or not kwargs.get("stream"):
+        return http.get(url, **kwargs)
+    tracker = latency_tracker(url)
+    delay = tracker.hedge_delay()
+    if delay is None:
+        return timed_get(url, tracker, **kwargs)
+
+    # The hedge timer starts once the primary is sent, not while it waits
+    # for a hedge_pool thread
+    sent = threading.Event()
+    primary = hedge_pool.submit(timed_get, url, tracker, sent, **kwargs)
+    sent.wait()
+    done, _ = wait([primary], timeout=delay)
+    if done or not tracker.allow_hedge():
+        return primary.result()
+
+    print(f"Hedging slow request to {url} after {delay:.2f}s")
+    pending = {primary, hedge_pool.submit(timed_get, url, tracker, **kwargs)}
+    winner, error = None, None
+    while pending and winner is None:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                error = future.exception()
+            elif winner is None:
+                winner = future.result()
+            else:
+                future.result().close()
+    if winner is None:
+        raise error
+    for loser in pending:
+        loser.add_done_callback(close_response)
+    return winner
+
+def origin_get(url, **kwargs):
+    """
+    GET a URL through the shared session, retrying throttling, server errors
+    and connection failures up to HTTP_RETRIES times and reporting each
+    outcome to the host's AdaptiveLimiter. The last response is returned
+    as-is, so callers still decide what to do with a final error status.
+    A timeout passed in kwargs replaces HTTP_TIMEOUT.
+    """
+    limiter = origin_limiter(url)
+    for attempt in range(HTTP_RETRIES + 1):
+        started = time.monotonic()
+        try:
+            response = hedged_get(url, **dict({"timeout": HTTP_TIMEOUT}, **kwargs))
+        except (requests.ConnectionError, requests.Timeout):
+            limiter.record("error")
+            if attempt == HTTP_RETRIES:
+                raise
+            time.sleep(retry_delay(None, attempt))
+            continue
+
+        status = response.status_code
+        if status in THROTTLE_STATUSES or status in RETRY_STATUSES:
+            limiter.record("throttled" if status in THROTTLE_STATUSES else "error")
+            if attempt == HTTP_RETRIES:
+                return response
+            delay = retry_delay(response, attempt)
+            print(f"Retrying {url} in {delay:.1f}s after HTTP {status}")
+            response.close()
+            time.sleep(delay)
+            continue
+
+        limiter.record("ok" if time.monotonic() - started < HTTP_SLOW_SECONDS else "slow")
+        return response
+
+def list_s3_objects(bucket, prefix=""):
+    """
+    Return a {key: {"etag", "size", "last_modified"}} dict for every object
+    under the given prefix.
+    """
+    paginator = s3.get_paginator("list_objects_v2")
+    keys = {}
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            keys[obj["Key"]] = {
+                "etag": obj["ETag"].strip('"'),
+                "size": obj.get("Size"),
+                "last_modified": obj.get("LastModified"),
+            }
+    return keys
+
+@lru_cache(maxsize=None)
+def listing_timezone():
+    """
+    Return the timezone of the BLS index timestamps, falling back to a
+    fixed UTC-5 offset if the tz database is unavailable.
+    """
+    try:
+        return ZoneInfo(BLS_TIMEZONE)
+    except Exception:
+        return timezone(timedelta(hours=-5))
+
+def parse_listing_entry(text):
+    """
+    Parse the date/time/size columns printed before a link in the BLS
+    directory index. Returns (size, mtime), or (None, None) if the text
+    does not look like an index entry.
+    """
+    match = LISTING_ENTRY_RE.search(text or "")
+    if not match or match.group(7).lower() == "<dir>":
+        return None, None
+    month, day, year, hour, minute = (int(g) for g in match.group(1, 2, 3, 4, 5))
+    hour = hour % 12 + (12 if match.group(6).upper() == "P" else 0)
+    mtime = datetime(year, month, day, hour, minute, tzinfo=listing_timezone())
+    return int(match.group(7)), mtime
+
+class ListingParser(HTMLParser):
+    """
+    Incremental parser for the BLS directory index. Feed it decoded text as
+    it arrives; each completed link is appended to `entries` as
+    (href, size, mtime), with size and mtime taken from the text directly
+    before the link.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.entries = []
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                size, mtime = parse_listing_entry("".join(self._text))
+                self.entries.append((href, size, mtime))
+        self._text = []
+
+    def handle_endtag(self, tag):
+        self._text = []
+
+    def handle_data(self, data):
+        self._text.append(data)
+
+def iter_listing(chunks, encoding="utf-8"):
+    """
+    Yield (href, size, mtime) records from a BLS directory index supplied as
+    an iterable of raw byte chunks, as soon as each link has been read.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    parser = ListingParser()
+    for chunk in chunks:
+        parser.feed(decoder.decode(chunk))
+        yield from parser.entries
+        parser.entries = []
+    parser.feed(decoder.decode(b"", final=True))
+    parser.close()
+    yield from parser.entries
+
+def fetch_listing(url):
+    """
+    Parse one BLS directory index. Returns (files, subdirs): a
+    {filename: {"url", "size", "mtime"}} dict, where size and mtime are None
+    when the index does not list them, and the URLs of the directories
+    below this one.
+    """
+    resp = origin_get(url, headers=HEADERS, stream=True)
+    try:
+        resp.raise_for_status()
+        encoding = requests.utils.get_encoding_from_headers(resp.headers) or "utf-8"
+        files, subdirs = {}, []
+        for href, size, mtime in iter_listing(resp.iter_content(chunk_size=CHUNK_SIZE), encoding):
+            if href.startswith("?"):
+                continue
+            full_url = urljoin(url, href)
+            if href.endswith("/"):
+                # Skip the parent directory and links that leave this tree
+                if full_url.startswith(url) and full_url != url:
+                    subdirs.append(full_url)
+            else:
+                fname = href.split("/")[-1].strip()
+                files[fname] = {"url": full_url, "size": size, "mtime": mtime}
+        return files, subdirs
+    finally:
+        resp.close()
+
+def fetch_remote_files(base_url=BLS_URL):
+    """
+    Return a {filename: {"url", "size", "mtime"}} dict of the files under
+    base_url. Subdirectories are crawled breadth-first up to CRAWL_MAX_DEPTH
+    levels, fetching each level's listings concurrently and visiting at most
+    CRAWL_MAX_DIRS directories; their files are keyed by their path
+    relative to base_url, e.g. "sub/file".
+    """
+    files = {}
+    seen = {base_url}
+    level = [base_url]
+    depth = 0
+    with ThreadPoolExecutor(max_workers=max(1, SYNC_WORKERS)) as pool:
+        while level:
+            next_level = []
+            for dir_url, (dir_files, subdirs) in zip(level, pool.map(fetch_listing, level)):
+                relative = dir_url[len(base_url):]
+                for fname, remote in dir_files.items():
+                    files[relative + fname] = remote
+                if depth >= CRAWL_MAX_DEPTH:
+                    continue
+                for subdir in subdirs:
+                    if subdir not in seen and len(seen) < CRAWL_MAX_DIRS:
+                        seen.add(subdir)
+                        next_level.append(subdir)
+            level = next_level
+            depth += 1
+    return files
+
+def listing_unchanged(remote, s3_object):
+    """
+    True if the directory index entry is the one recorded when the S3 copy
+    was last synced or, for objects without a recorded entry, if the remote
+    file has the same size as the S3 copy and was last modified before the
+    copy was written.
+    """
+    if remote.get("size") is None or remote.get("mtime") is None:
+        return False
+    if s3_object.get("listing_mtime"):
+        return (remote["size"] == s3_object.get("listing_size")
+                and remote["mtime"].isoformat() == s3_object["listing_mtime"])
+    if s3_object.get("last_modified") is None:
+        return False
+    return remote["size"] == s3_object.get("size") and remote["mtime"] <= s3_object["last_modified"]
+
+def manifest_entry(remote, etag, size, checksum, metadata, encoding=None, sha256=None):
+    """
+    Build the manifest entry describing a file's S3 copy after a sync.
+    sha256 is the hex digest of the stored bytes, when known; unlike a
+    composite checksum it does not depend on how the object was uploaded.
+    """
+    return {
+        "etag": etag,
+        "size": size,
+        "checksum": checksum,
+        "sha256": sha256,
+        "metadata": metadata,
+        "encoding": encoding,
+        "listing_size": remote.get("size"),
+        "listing_mtime": remote["mtime"].isoformat() if remote.get("mtime") else None,
+        "synced_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+def load_manifest(key=MANIFEST_KEY):
+    """
+    Read a dataset's sync manifest. Returns None if there is no manifest
+    yet or it was written with a different schema version.
+    """
+    try:
+        response = s3.get_object(Bucket=BUCKET, Key=key)
+        manifest = json.loads(response["Body"].read())
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            return None
+        raise
+    except ValueError:
+        print(f"Ignoring unreadable manifest s3://{BUCKET}/{key}")
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+def save_manifest(manifest, key=MANIFEST_KEY):
+    """
+    Write the manifest back with a single PUT, so readers see either the
+    previous run's state or this one's, never a mix.
+    """
+    s3.put_object(
+        Bucket=BUCKET, Key=key,
+        Body=json.dumps(manifest, sort_keys=True),
+        ContentType="application/json"
+    )
+
+def reconcile_due(manifest, now):
+    """
+    True if the manifest must be checked against a full listing of the prefix.
+    """
+    if manifest is None:
+        return True
+    try:
+        reconciled_at = datetime.fromisoformat(manifest["reconciled_at"])
+    except (KeyError, TypeError, ValueError):
+        return True
+    return now - reconciled_at >= timedelta(hours=RECONCILE_HOURS)
+
+def managed_prefixes(prefix):
+    """
+    Prefixes nested under prefix that have a sync manifest of their own,
+    i.e. that are or were mirrored by another dataset. Datasets removed from
+    the registry keep their manifest, so their files are still recognized.
+    """
+    state = f"_sync/{prefix.rstrip('/')}/"
+    return [
+        key[len("_sync/"):-len("manifest.json")]
+        for key in list_s3_objects(BUCKET, state)
+        if key.endswith("/manifest.json") and key != f"{state}manifest.json"
+    ]
+
+def s3_state(manifest, reconcile, prefix=BLS_PREFIX, exclude_prefixes=()):
+    """
+    Return the {key: record} view of the mirrored prefix. Normally this comes
+    straight from the manifest; a reconciliation pass lists the prefix and
+    keeps manifest details only for objects whose ETag still matches.
+    Keys under exclude_prefixes, or under any nested prefix with its own
+    manifest, belong to other datasets and are left out.
+    """
+    entries = (manifest or {}).get("files", {})
+    if not reconcile:
+        return {prefix + fname: dict(entry) for fname, entry in entries.items()}
+
+    exclude = tuple(exclude_prefixes) + tuple(managed_prefixes(prefix))
+    s3_files = {
+        key: record for key, record in list_s3_objects(BUCKET, prefix).items()
+        if not key.startswith(exclude)
+    }
+    for key, record in s3_files.items():
+        entry = entries.get(key[len(prefix):])
+        if entry and entry.get("etag") == record["etag"]:
+            record.update({k: v for k, v in entry.items() if k not in record})
+    return s3_files
+
+def origin_metadata(response):
+    """
+    Return the origin's HTTP validators as S3 user metadata, so the next
+    sync can revalidate the file with a conditional GET.
+    """
+    metadata = {}
+    if response.headers.get("ETag"):
+        metadata["origin-etag"] = response.headers["ETag"]
+    if response.headers.get("Last-Modified"):
+        metadata["origin-last-modified"] = response.headers["Last-Modified"]
+    return metadata
+
+def download_headers():
+    """
+    Request headers for downloading a BLS file. In compressed mode only gzip
+    is accepted, since that is the encoding the bytes are stored in.
+    """
+    headers = dict(HEADERS)
+    if COMPRESS_BLS:
+        headers["Accept-Encoding"] = "gzip"
+    return headers
+
+def conditional_headers(metadata):
+    """
+    Build request headers that turn a GET into a revalidation against the
+    validators stored on the S3 copy.
+    """
+    headers = download_headers()
+    if metadata.get("origin-etag"):
+        headers["If-None-Match"] = metadata["origin-etag"]
+    if metadata.get("origin-last-modified"):
+        headers["If-Modified-Since"] = metadata["origin-last-modified"]
+    return headers
+
+def s3_checksum(whole_digest, part_digests):
+    """
+    Return the SHA-256 checksum S3 reports for an object we uploaded: the
+    base64 digest of the body for a single put_object, or the composite
+    "<digest of part digests>-<N>" for a multipart upload.
+    """
+    if not part_digests:
+        return base64.b64encode(whole_digest).decode()
+    composite = hashlib.sha256(b"".join(part_digests)).digest()
+    return f"{base64.b64encode(composite).decode()}-{len(part_digests)}"
+
+def content_sha256(checksum):
+    """
+    Return the hex SHA-256 digest behind a full-object (not composite)
+    base64 checksum, or None.
+    """
+    if not checksum or "-" in checksum:
+        return None
+    return base64.b64decode(checksum).hex()
+
+def body_matches(existing, checksums, md5):
+    """
+    True if a streamed body is identical to the existing S3 object. Objects
+    carry a SHA-256 checksum we control, either full-object or composite
+    depending on how they were written; objects uploaded before checksums
+    were recorded fall back to the ETag, which is only an MD5 of the
+    content for single-part uploads.
+    """
+    if not existing:
+        return False
+    if existing.get("checksum"):
+        return existing["checksum"] in checksums
+    etag = existing.get("etag") or ""
+    return "-" not in etag and etag == md5
+
+def upload_part(key, upload_id, parts, body):
+    """
+    Upload the next part of a multipart upload with its SHA-256 checksum,
+    record it in parts and return the part's digest.
+    """
+    part_number = len(parts) + 1
+    digest = hashlib.sha256(body).digest()
+    part_checksum = base64.b64encode(digest).decode()
+    part = s3.upload_part(
+        Bucket=BUCKET, Key=key, UploadId=upload_id,
+        PartNumber=part_number, Body=body,
+        ChecksumAlgorithm="SHA256", ChecksumSHA256=part_checksum
+    )
+    parts.append({
+        "PartNumber": part_number,
+        "ETag": part["ETag"],
+        "ChecksumSHA256": part_checksum,
+    })
+    return digest
+
+def body_chunks(response, encoding=None):
+    """
+    Yield the bytes to store for a streamed response. With encoding="gzip",
+    a gzip-encoded body is passed through undecoded and any other body is
+    gzip-compressed on the fly.
+    """
+    if encoding != "gzip":
+        yield from response.iter_content(chunk_size=CHUNK_SIZE)
+        return
+    if response.headers.get("Content-Encoding", "").lower() == "gzip":
+        yield from response.raw.stream(CHUNK_SIZE, decode_content=False)
+        return
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+        yield compressor.compress(chunk)
+    yield compressor.flush()
+
+def stream_to_s3(response, key, metadata=None, existing=None, encoding=None):
+    """
+    Copy a streamed HTTP response body to S3 with upload_chunks, closing
+    the response whatever happens. With encoding="gzip" the body is stored
+    compressed (see body_chunks).
+    """
+    try:
+        return upload_chunks(body_chunks(response, encoding), key, metadata, existing, encoding)
+    finally:
+        response.close()
+
+def upload_chunks(chunks, key, metadata=None, existing=None, encoding=None, content_type=None):
+    """
+    Write an iterable of byte chunks to S3, computing its checksums on
+    the way. Bodies up to PART_SIZE are sent with a single put_object;
+    larger ones go through a multipart upload, so memory use is bounded by
+    one part. Every upload carries a SHA-256 checksum so later runs can
+    compare content regardless of how the object was uploaded.
+    encoding is stored as the Content-Encoding of the chunks, and checksums
+    cover the stored bytes. If the body matches the existing object ({"checksum", "etag"}) it is
+    left alone. Returns a dict with the body's "checksum" (as S3 reports it),
+    "full_checksum", "size", the S3 "etag" when "written", and "written".
+    """
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    buffer = bytearray()
+    upload_id = None
+    parts = []
+    part_digests = []
+    object_args = {"Metadata": metadata or {}}
+    if encoding:
+        object_args.update(ContentEncoding=encoding, ContentType="text/plain")
+    if content_type:
+        object_args["ContentType"] = content_type
+
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            md5.update(chunk)
+            sha256.update(chunk)
+            buffer.extend(chunk)
+            # Only flush once the buffer exceeds a part, so a body of exactly
+            # PART_SIZE still goes out as a single put_object.
+            while len(buffer) > PART_SIZE:
+                if upload_id is None:
+                    upload_id = s3.create_multipart_upload(
+                        Bucket=BUCKET, Key=key, ChecksumAlgorithm="SHA256", **object_args
+                    )["UploadId"]
+                part_digests.append(upload_part(key, upload_id, parts, bytes(buffer[:PART_SIZE])))
+                del buffer[:PART_SIZE]
+
+        size = len(parts) * PART_SIZE + len(buffer)
+        full_checksum = s3_checksum(sha256.digest(), [])
+        result = {"full_checksum": full_checksum, "size": size, "etag": None, "written": False}
+        if upload_id is None:
+            result["checksum"] = full_checksum
+            if body_matches(existing, {full_checksum}, md5.hexdigest()):
+                return result
+            uploaded = s3.put_object(
+                Bucket=BUCKET, Key=key, Body=bytes(buffer),
+                ChecksumAlgorithm="SHA256", ChecksumSHA256=full_checksum, **object_args
+            )
+            result.update(etag=uploaded["ETag"].strip('"'), written=True)
+            return result
+
+        final_digest = hashlib.sha256(bytes(buffer)).digest()
+        result["checksum"] = s3_checksum(sha256.digest(), part_digests + [final_digest])
+        if body_matches(existing, {result["checksum"], full_checksum}, md5.hexdigest()):
+            s3.abort_multipart_upload(Bucket=BUCKET, Key=key, UploadId=upload_id)
+            return result
+        upload_part(key, upload_id, parts, bytes(buffer))
+        uploaded = s3.complete_multipart_upload(
+            Bucket=BUCKET, Key=key, UploadId=upload_id,
+            MultipartUpload={"Parts": parts}
+        )
+        result.update(etag=uploaded["ETag"].strip('"'), written=True)
+        return result
+    except Exception:
+        if upload_id is not None:
+            s3.abort_multipart_upload(Bucket=BUCKET, Key=key, UploadId=upload_id)
+        raise
+
+def upload_file_to_s3(filename, remote, prefix=BLS_PREFIX):
+    """
+    Stream a remote file into S3 and return its manifest entry.
+    """
+    print(f"Uploading: {filename}")
+    r = origin_get(remote["url"], headers=download_headers(), stream=True)
+    try:
+        r.raise_for_status()
+    except Exception:
+        r.close()
+        raise
+    metadata = origin_metadata(r)
+    encoding = "gzip" if COMPRESS_BLS else None
+    result = stream_to_s3(r, prefix + filename, metadata, encoding=encoding)
+    return manifest_entry(
+        remote, result["etag"], result["size"], result["checksum"], metadata, encoding,
+        content_sha256(result["full_checksum"])
+    )
+
+def can_append(remote, record):
+    """
+    True if the directory index shows the remote file has grown past an S3
+    copy large enough to be reused as a copied part.
+    """
+    old_size, new_size = record.get("size"), remote.get("size")
+    if old_size is None or new_size is None:
+        return False
+    return MIN_PART_SIZE <= old_size < new_size
+
+def append_tail(fname, remote, record, prefix=BLS_PREFIX):
+    """
+    Bring the S3 copy of a file that only had rows appended up to date by
+    fetching just the new bytes. The new object is built server-side from a
+    copy of the existing one plus the uploaded tail. Returns the manifest
+    entry, or None if the change is not a pure append, in which case the
+    caller falls back to a full transfer.
+    """
+    key = prefix + fname
+    old_size = record["size"]
+
+    # Compare the end of the old content with the same bytes at the origin
+    window = min(DELTA_CHECK_BYTES, old_size)
+    check_range = f"bytes={old_size - window}-{old_size - 1}"
+    origin = origin_get(remote["url"], headers=dict(HEADERS, Range=check_range), stream=True)
+    try:
+        if origin.status_code != 206:
+            return None
+        # Read one byte past the window, so an origin that sends more than
+        # the range asked for fails the comparison instead of being read.
+        probe = bytearray()
+        for chunk in origin.iter_content(chunk_size=min(CHUNK_SIZE, window + 1)):
+            probe.extend(chunk)
+            if len(probe) > window:
+                break
+    finally:
+        origin.close()
+    stored = s3.get_object(Bucket=BUCKET, Key=key, Range=check_range)["Body"].read()
+    if bytes(probe) != stored:
+        return None
+
+    # If-Range makes the origin send the full body instead of a range if the
+    # file changed again between the two requests.
+    headers = dict(HEADERS, Range=f"bytes={old_size}-")
+    validator = origin.headers.get("ETag") or origin.headers.get("Last-Modified")
+    if validator:
+        headers["If-Range"] = validator
+    tail = origin_get(remote["url"], headers=headers, stream=True)
+    content_range = tail.headers.get("Content-Range", "")
+    if tail.status_code != 206 or not content_range.startswith(f"bytes {old_size}-"):
+        tail.close()
+        return None
+
+    metadata = origin_metadata(tail)
+    upload_id = s3.create_multipart_upload(
+        Bucket=BUCKET, Key=key, Metadata=metadata, ChecksumAlgorithm="SHA256"
+    )["UploadId"]
+    try:
+        copied = s3.upload_part_copy(
+            Bucket=BUCKET, Key=key, UploadId=upload_id, PartNumber=1,
+            CopySource={"Bucket": BUCKET, "Key": key}
+        )["CopyPartResult"]
+        parts = [{"PartNumber": 1, "ETag": copied["ETag"]}]
+        if copied.get("ChecksumSHA256"):
+            parts[0]["ChecksumSHA256"] = copied["ChecksumSHA256"]
+
+        buffer = bytearray()
+        tail_size = 0
+        for chunk in tail.iter_content(chunk_size=CHUNK_SIZE):
+            buffer.extend(chunk)
+            tail_size += len(chunk)
+            while len(buffer) > PART_SIZE:
+                upload_part(key, upload_id, parts, bytes(buffer[:PART_SIZE]))
+                del buffer[:PART_SIZE]
+        if not tail_size:
+            s3.abort_multipart_upload(Bucket=BUCKET, Key=key, UploadId=upload_id)
+            return None
+        upload_part(key, upload_id, parts, bytes(buffer))
+        completed = s3.complete_multipart_upload(
+            Bucket=BUCKET, Key=key, UploadId=upload_id,
+            MultipartUpload={"Parts": parts}
+        )
+    except Exception:
+        s3.abort_multipart_upload(Bucket=BUCKET, Key=key, UploadId=upload_id)
+        raise
+    finally:
+        tail.close()
+
+    # The composite checksum follows this object's own part layout, so a
+    # later content comparison may re-upload it once; validators make that rare.
+    return manifest_entry(
+        remote, completed["ETag"].strip('"'), old_size + tail_size,
+        completed.get("ChecksumSHA256"), metadata
+    )
+
+def sync_file(fname, remote, s3_files, prefix=BLS_PREFIX):
+    """
+    Bring a single BLS file in S3 up to date with the remote copy.
+    Returns (action, entry): the action taken, "uploaded", "updated",
+    "appended" or "unchanged", and the file's manifest entry after the sync.
+    """
+    s3_key = prefix + fname
+    record = s3_files.get(s3_key)
+    if record is None:
+        return "uploaded", upload_file_to_s3(fname, remote, prefix)
+
+    if SYNC_MODE == "listing" and listing_unchanged(remote, record):
+        print(f"✅ Up-to-date (listing): {fname}")
+        return "unchanged", manifest_entry(
+            remote, record["etag"], record.get("size"), record.get("checksum"),
+            record.get("metadata", {}), record.get("encoding"), record.get("sha256")
+        )
+
+    # Records from the manifest already carry the object's validators and
+    # checksum; only objects it does not describe need a HEAD request.
+    if "metadata" in record:
+        metadata, checksum = record["metadata"], record.get("checksum")
+        stored_encoding = record.get("encoding")
+    else:
+        head = s3.head_object(Bucket=BUCKET, Key=s3_key, ChecksumMode="ENABLED")
+        metadata, checksum = head.get("Metadata", {}), head.get("ChecksumSHA256")
+        stored_encoding = head.get("ContentEncoding")
+
+    # Byte ranges can only be appended to uncompressed copies
+    if DELTA_SYNC and not COMPRESS_BLS and not stored_encoding and can_append(remote, record):
+        entry = append_tail(fname, remote, record, prefix)
+        if entry is not None:
+            print(f"Appended new rows to: {fname}")
+            return "appended", entry
+
+    r = origin_get(remote["url"], headers=conditional_headers(metadata), stream=True)
+    if r.status_code == 304:
+        r.close()
+        print(f"✅ Up-to-date (not modified): {fname}")
+        return "unchanged", manifest_entry(
+            remote, record["etag"], record.get("size"), checksum, metadata, stored_encoding,
+            record.get("sha256")
+        )
+    try:
+        r.raise_for_status()
+    except Exception:
+        r.close()
+        raise
+
+    # Stream the body into a replacement object, keeping the existing one
+    # if the content turns out to be identical.
+    validators = origin_metadata(r)
+    encoding = "gzip" if COMPRESS_BLS else None
+    existing = {"checksum": checksum, "etag": record["etag"]}
+    result = stream_to_s3(r, s3_key, validators, existing=existing, encoding=encoding)
+    if result["written"]:
+        print(f"Updating modified file: {fname}")
+        return "updated", manifest_entry(
+            remote, result["etag"], result["size"], result["checksum"], validators, encoding,
+            content_sha256(result["full_checksum"])
+        )
+
+    # Content matches but the object predates stored validators: record them
+    # with a server-side copy so the next run can revalidate without a body.
+    # Identical checksums mean the stored bytes are already in this run's
+    # encoding; REPLACE resets Content-Encoding and Content-Type, so they are
+    # passed again as stream_to_s3 set them.
+    etag = record["etag"]
+    if validators and validators != metadata:
+        copy_args = {"ContentEncoding": encoding, "ContentType": "text/plain"} if encoding else {}
+        copy = s3.copy_object(
+            Bucket=BUCKET, Key=s3_key,
+            CopySource={"Bucket": BUCKET, "Key": s3_key},
+            Metadata=validators, MetadataDirective="REPLACE",
+            ChecksumAlgorithm="SHA256", **copy_args
+        )
+        etag = copy["CopyObjectResult"]["ETag"].strip('"')
+        metadata, checksum = validators, result["full_checksum"]
+    print(f"✅ Up-to-date: {fname}")
+    return "unchanged", manifest_entry(
+        remote, etag, result["size"], checksum or result["checksum"], metadata, encoding,
+        content_sha256(result["full_checksum"])
+    )
+
+def run_transfers(remote_files, s3_files, deadline=None, prefix=BLS_PREFIX, url=BLS_URL):
+    """
+    Run sync_file for every remote file on a bounded thread pool, in the
+    order given. How many files transfer at once is further limited by the
+    AdaptiveLimiter of url's host, which backs off when the origin throttles
+    and is shared by every dataset synced from that host at the same time. Files are only
+    started before the time.monotonic()
+    deadline, if one is set; files never started are absent from the result.
+    Returns (results, errors, entries), all keyed by file name and sorted by
+    it, so the outcome of a run does not depend on completion order.
+    """
+    results, errors, entries = {}, {}, {}
+    workers = max(1, SYNC_WORKERS)
+    queue = iter(remote_files.items())
+    futures = {}
+    limiter = origin_limiter(url)
+
+    def limited_sync_file(fname, remote):
+        with limiter:
+            # The wait for a slot can be long while the origin throttles,
+            # so the deadline is checked again before starting the file.
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            return sync_file(fname, remote, s3_files, prefix)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        def submit_next():
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            item = next(queue, None)
+            if item is not None:
+                fname, remote = item
+                futures[pool.submit(limited_sync_file, fname, remote)] = fname
+
+        for _ in range(workers):
+            submit_next()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                fname = futures.pop(future)
+                try:
+                    outcome = future.result()
+                    if outcome is not None:
+                        results[fname], entries[fname] = outcome
+                except Exception as e:
+                    errors[fname] = str(e)
+                submit_next()
+    return dict(sorted(results.items())), dict(sorted(errors.items())), dict(sorted(entries.items()))
+
+def delete_s3_keys(keys):
+    """
+    Delete the given keys with DeleteObjects batches of up to
+    DELETE_BATCH_SIZE keys, running the batches concurrently.
+    Returns a {key: error} dict, sorted by key, for keys S3 did not delete.
+    """
+    keys = sorted(keys)
+    batches = [keys[i:i + DELETE_BATCH_SIZE] for i in range(0, len(keys), DELETE_BATCH_SIZE)]
+    if not batches:
+        return {}
+
+    def delete_batch(batch):
+        response = s3.delete_objects(
+            Bucket=BUCKET,
+            Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True}
+        )
+        return {
+            error["Key"]: f"{error.get('Code')}: {error.get('Message')}"
+            for error in response.get("Errors", [])
+        }
+
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(SYNC_WORKERS, len(batches)))) as pool:
+        futures = {pool.submit(delete_batch, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            try:
+                errors.update(future.result())
+            except Exception as e:
+                for key in futures[future]:
+                    errors[key] = str(e)
+    return dict(sorted(errors.items()))
+
+def sync_deadline(context):
+    """
+    Return the time.monotonic() value after which no new transfer should
+    start, or None when not running inside Lambda.
+    """
+    get_remaining = getattr(context, "get_remaining_time_in_millis", None)
+    if get_remaining is None:
+        return None
+    return time.monotonic() + get_remaining() / 1000 - CHECKPOINT_MARGIN_SECONDS
+
+def load_checkpoint(key=CHECKPOINT_KEY):
+    """
+    Read the checkpoint left by an unfinished sync, or None if there is none.
+    """
+    try:
+        response = s3.get_object(Bucket=BUCKET, Key=key)
+        return json.loads(response["Body"].read())
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            return None
+        raise
+    except ValueError:
+        print(f"Ignoring unreadable checkpoint s3://{BUCKET}/{key}")
+        return None
+
+def resume_sync(context, resume_count, datasets=None):
+    """
+    Re-invoke this function asynchronously to continue an unfinished sync,
+    limited to the named datasets if given. Returns False if the resume limit is reached or the invoke fails, in
+    which case the next scheduled run picks up the checkpoint instead.
+    """
+    function_arn = getattr(context, "invoked_function_arn", None)
+    if not function_arn or resume_count >= MAX_RESUMES:
+        return False
+    payload = {"resume": True, "resume_count": resume_count + 1}
+    if datasets:
+        payload["datasets"] = datasets
+    try:
+        boto3.client("lambda").invoke(
+            FunctionName=function_arn,
+            InvocationType="Event",
+            Payload=json.dumps(payload),
+        )
+        return True
+    except Exception as e:
+        print(f"Could not re-invoke {function_arn}: {e}")
+        return False
+
+def dataset_config(name, url=None, prefix=None, include=None, exclude=None, priority=0):
+    """
+    Return a registry entry with its defaults filled in: surveys are read
+    from BLS_SERIES_URL/<name>/ and mirrored to bls-data/<name>/, except
+    "pr", which stays directly under BLS_PREFIX.
+    """
+    if not name or not re.fullmatch(r"[A-Za-z0-9_.-]+", name):
+        raise ValueError(f"Invalid dataset name: {name!r}")
+    if prefix is None:
+        prefix = BLS_PREFIX if name == "pr" else f"{BLS_PREFIX}{name}/"
+    prefix = prefix.rstrip("/") + "/"
+    state = f"_sync/{prefix.rstrip('/')}"
+    return {
+        "name": name,
+        "url": (url or f"{BLS_SERIES_URL}{name}/").rstrip("/") + "/",
+        "prefix": prefix,
+        "include": list(include or ["*"]),
+        "exclude": list(exclude or []),
+        "priority": int(priority),
+        "manifest_key": f"{state}/manifest.json",
+        "checkpoint_key": f"{state}/checkpoint.json",
+        "runs_prefix": f"{state}/runs/",
+    }
+
+def load_datasets(spec=None):
+    """
+    Parse the dataset registry from BLS_DATASETS: either survey codes such as
+    "pr,ce,cu,la", or a JSON list of objects with "name" and optional "url",
+    "prefix", "include"/"exclude" fnmatch patterns on file names and
+    "priority". Returns the datasets with the highest priority first.
+    Raises ValueError for a malformed registry.
+    """
+    spec = (BLS_DATASETS if spec is None else spec).strip()
+    if spec.startswith("["):
+        entries = json.loads(spec)
+        if not all(isinstance(entry, dict) for entry in entries):
+            raise ValueError("BLS_DATASETS entries must be objects")
+        datasets = [dataset_config(**entry) for entry in entries]
+    else:
+        datasets = [dataset_config(name.strip()) for name in spec.split(",") if name.strip()]
+
+    names = [d["name"] for d in datasets]
+    prefixes = [d["prefix"] for d in datasets]
+    if len(set(names)) != len(names) or len(set(prefixes)) != len(prefixes):
+        raise ValueError("BLS_DATASETS names and prefixes must be unique")
+    return sorted(datasets, key=lambda d: (-d["priority"], d["name"]))
+
+def dataset_selects(dataset, fname):
+    """
+    True if a remote file matches the dataset's include patterns and none of
+    its exclude patterns.
+    """
+    return (
+        any(fnmatch(fname, pattern) for pattern in dataset["include"])
+        and not any(fnmatch(fname, pattern) for pattern in dataset["exclude"])
+    )
+
+def sync_plan(dataset, nested_prefixes=()):
+    """
+    Compare a dataset's S3 copy with the remote listing. Returns the plan
+    shared by a local sync and a fan-out run: the files to sync ("remote"),
+    the S3 records of those already mirrored ("records"), the manifest
+    entries they keep if not re-synced ("files"), the S3 records of files
+    no longer present remotely ("stale") and the manifest bookkeeping.
+    """
+    name, prefix = dataset["name"], dataset["prefix"]
+    now = datetime.now(timezone.utc)
+    print(f"[{name}] Checking current S3 bucket state...")
+    manifest = load_manifest(dataset["manifest_key"])
+    reconcile = reconcile_due(manifest, now)
+    if reconcile:
+        print(f"[{name}] Reconciling sync manifest with a full S3 listing...")
+    s3_files = s3_state(manifest, reconcile, prefix, nested_prefixes)
+
+    print(f"[{name}] Fetching file list from {dataset['url']}")
+    remote_files = {
+        fname: remote for fname, remote in fetch_remote_files(dataset["url"]).items()
+        if dataset_selects(dataset, fname)
+    }
+    if not s3_files:
+        print(f"[{name}] S3 is empty — uploading all files.")
+
+    remote_keys = set(prefix + fname for fname in remote_files)
+    return {
+        "dataset": dataset,
+        "created_at": now.isoformat(),
+        "generation": (manifest or {}).get("generation", 0) + 1,
+        "reconciled_at": now.isoformat() if reconcile else manifest.get("reconciled_at"),
+        "remote": remote_files,
+        "records": {key: record for key, record in s3_files.items() if key in remote_keys},
+        # The listing time is only needed to decide this run's transfers
+        "files": {
+            key[len(prefix):]: {k: v for k, v in record.items() if k != "last_modified"}
+            for key, record in s3_files.items() if key in remote_keys
+        },
+        "stale": {
+            key: {k: v for k, v in record.items() if k != "last_modified"}
+            for key, record in s3_files.items() if key not in remote_keys
+        },
+    }
+
+def commit_sync(plan, results, errors, entries):
+    """
+    Finish a sync once its transfers are done: delete the files no longer
+    present remotely and write the manifest. Files not synced keep their
+    previous entry, and keys that could not be deleted stay listed so the
+    next run retries them. Returns the dataset's summary dict.
+    """
+    dataset = plan["dataset"]
+    name, prefix = dataset["name"], dataset["prefix"]
+
+    summary = {}
+    for action in results.values():
+        summary[action] = summary.get(action, 0) + 1
+    for fname, error in errors.items():
+        print(f"❌ [{name}] Failed to sync {fname}: {error}")
+
+    # Delete files from S3 that are no longer present remotely
+    stale = plan["stale"]
+    if stale:
+        print(f"[{name}] Deleting {len(stale)} removed file(s) from S3")
+    delete_errors = delete_s3_keys(stale)
+    for key, error in delete_errors.items():
+        print(f"❌ [{name}] Failed to delete {key}: {error}")
+
+    files = dict(plan["files"])
+    for key in delete_errors:
+        files[key[len(prefix):]] = stale[key]
+    files.update(entries)
+    if SNAPSHOTS:
+        # Digests read back from S3 are kept in the manifest, so the
+        # snapshot of the next run does not have to read the objects again.
+        try:
+            files.update(fill_sha256(prefix, {f: files[f] for f in plan["remote"] if f in files}))
+        except Exception as e:
+            print(f"❌ [{name}] Hashing stored files failed: {e}")
+    save_manifest({
+        "version": MANIFEST_VERSION,
+        "prefix": prefix,
+        "generation": plan["generation"],
+        "synced_at": plan["created_at"],
+        "reconciled_at": plan["reconciled_at"],
+        "files": dict(sorted(files.items())),
+    }, dataset["manifest_key"])
+    outcome = {
+        "ok": not errors and not delete_errors,
+        "summary": summary,
+        "failed": len(errors),
+        "deleted": len(stale) - len(delete_errors),
+    }
+    # Only files mirrored by this run are snapshotted or materialized, so
+    # failed deletions and failed transfers of new files are left out.
+    mirrored = {f: files[f] for f in plan["remote"] if f in files}
+    if SNAPSHOTS:
+        try:
+            outcome["snapshot"] = write_snapshot(dataset, plan, mirrored)
+        except Exception as e:
+            print(f"❌ [{name}] Snapshot failed: {e}")
+            outcome["ok"] = False
+    if PARQUET and pandas_module() is not None:
+        for fname, entry in mirrored.items():
+            if not any(fnmatch(fname, pattern) for pattern in PARQUET_BLS_FILES):
+                continue
+            try:
+                materialize_parquet(prefix + fname, entry["etag"], bls_frame, encoding=entry.get("encoding"))
+            except Exception as e:
+                print(f"❌ [{name}] Parquet copy of {fname} failed: {e}")
+                outcome["ok"] = False
+    return outcome
+
+@lru_cache(maxsize=None)
+def pandas_module():
+    """
+    Import pandas on first use, so syncs without Parquet mode do not pay
+    for it at cold start. Returns None if pandas or pyarrow is missing.
+    """
+    try:
+        importlib.import_module("pyarrow")
+        return importlib.import_module("pandas")
+    except ImportError:
+        print("pandas/pyarrow not available; Parquet copies are skipped")
+        return None
+
+def parquet_key(key):
+    return f"{PARQUET_PREFIX}{key}.parquet"
+
+def strip_frame(df):
+    """
+    Trim whitespace from column names and string values.
+    """
+    is_string_dtype = pandas_module().api.types.is_string_dtype
+    df.columns = df.columns.str.strip()
+    for column in df.columns:
+        if is_string_dtype(df[column]):
+            df[column] = df[column].str.strip()
+    return df
+
+def bls_frame(body):
+    """
+    Parse a tab-separated BLS file into a DataFrame with BLS_COLUMN_DTYPES
+    applied to the columns it has.
+    """
+    pd = pandas_module()
+    df = strip_frame(pd.read_csv(io.BytesIO(body), sep="\t", dtype=str, keep_default_na=False))
+    for column, dtype in BLS_COLUMN_DTYPES.items():
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors="coerce").astype(dtype)
+    return df
+
+def population_frame(body):
+    """
+    Parse the datausa population JSON into a DataFrame with snake_case
+    column names, as the report uses them.
+    """
+    pd = pandas_module()
+    df = strip_frame(pd.DataFrame(json.loads(body)["data"]))
+    df.columns = [re.sub(r"\W+", "_", column).lower() for column in df.columns]
+    return df.astype({"year": "int32", "population": "float64"})
+
+def materialize_parquet(source_key, source_tag, to_frame, body=None, encoding=None):
+    """
+    Write a Parquet copy of an S3 object built with to_frame(body), unless
+    the existing copy was made from the same source version. source_tag,
+    stored as "source-tag" metadata, is the raw object's ETag or content
+    hash, so readers can tell whether the copy is current. The body is read
+    from S3 if not given.
+    Returns True if a copy was written.
+    """
+    key = parquet_key(source_key)
+    try:
+        head = s3.head_object(Bucket=BUCKET, Key=key)
+        if head.get("Metadata", {}).get("source-tag") == source_tag:
+            return False
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404", "NotFound"):
+            raise
+
+    if body is None:
+        body = s3.get_object(Bucket=BUCKET, Key=source_key)["Body"].read()
+        if encoding == "gzip":
+            body = gzip.decompress(body)
+    buffer = io.BytesIO()
+    to_frame(body).to_parquet(buffer, index=False, compression="snappy")
+    s3.put_object(
+        Bucket=BUCKET, Key=key, Body=buffer.getvalue(),
+        ContentType="application/vnd.apache.parquet",
+        Metadata={"source-tag": source_tag}
+    )
+    print(f"Wrote Parquet copy s3://{BUCKET}/{key}")
+    return True
+
+def snapshot_blob_key(sha256):
+    return f"{SNAPSHOT_PREFIX}objects/{sha256[:2]}/{sha256}"
+
+def hash_s3_object(key):
+    """
+    Return the hex SHA-256 of a stored object's bytes, reading it in chunks.
+    Only needed for objects whose manifest entry has no "sha256", such as
+    files brought up to date by append_tail.
+    """
+    digest = hashlib.sha256()
+    body = s3.get_object(Bucket=BUCKET, Key=key)["Body"]
+    for chunk in iter(lambda: body.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def fill_sha256(prefix, files):
+    """
+    Return updated copies of the manifest entries in files that have no
+    "sha256", taking it from their full-object checksum or, failing that,
+    by reading the stored object. The caller saves them in the manifest,
+    so each object is read at most once.
+    """
+    filled, missing = {}, []
+    for fname, entry in files.items():
+        if entry.get("sha256"):
+            continue
+        digest = content_sha256(entry.get("checksum"))
+        if digest:
+            filled[fname] = dict(entry, sha256=digest)
         else:
-            for fname, url in remote_files.items():
-                s3_key = BLS_PREFIX + fname
-                r = requests.get(url, headers=HEADERS)
-                r.raise_for_status()
-                md5 = get_md5(r.content)
-
-                # Upload new or updated files only
-                if s3_key not in s3_files:
-                    print(f"Uploading new file: {fname}")
-                    s3.put_object(Bucket=BUCKET, Key=s3_key, Body=r.content)
-                elif s3_files[s3_key] != md5:
-                    print(f"Updating modified file: {fname}")
-                    s3.put_object(Bucket=BUCKET, Key=s3_key, Body=r.content)
-                else:
-                    print(f"✅ Up-to-date: {fname}")
-
-            # Delete files from S3 that are no longer present remotely
-            remote_keys = set(BLS_PREFIX + fname for fname in remote_files)
-            for key in s3_files:
-                if key not in remote_keys:
-                    print(f"Deleting removed file from S3: {key}")
-                    s3.delete_object(Bucket=BUCKET, Key=key)
+            missing.append(fname)
+    with ThreadPoolExecutor(max_workers=max(1, SYNC_WORKERS)) as pool:
+        for fname, digest in zip(missing, pool.map(lambda f: hash_s3_object(prefix + f), missing)):
+            filled[fname] = dict(files[fname], sha256=digest)
+    return filled
+
+def store_blob(sha256, key):
+    """
+    Make sure the snapshot store holds the body of key under its hash,
+    copying it server-side (with its Content-Encoding) if it is missing.
+    Returns True if a copy was made.
+    """
+    blob_key = snapshot_blob_key(sha256)
+    try:
+        s3.head_object(Bucket=BUCKET, Key=blob_key)
+        return False
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404", "NotFound"):
+            raise
+    s3.copy_object(
+        Bucket=BUCKET, Key=blob_key,
+        CopySource={"Bucket": BUCKET, "Key": key},
+        ChecksumAlgorithm="SHA256"
+    )
+    return True
+
+def write_snapshot(dataset, plan, files):
+    """
+    Record a point-in-time snapshot of a dataset: store each distinct body
+    once under its hash (bodies already referenced by the latest snapshot are
+    known to be stored), write the run's snapshot manifest and move the
+    dataset's latest.json pointer to it. The pointer is replaced with a
+    conditional PUT, so a slower concurrent run cannot move it back.
+    Returns the snapshot manifest's key.
+    """
+    name, prefix = dataset["name"], dataset["prefix"]
+    root = f"{SNAPSHOT_PREFIX}{name}/"
+    latest_key = root + "latest.json"
+    try:
+        response = s3.get_object(Bucket=BUCKET, Key=latest_key)
+        latest, latest_etag = json.loads(response["Body"].read()), response["ETag"]
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+            raise
+        latest, latest_etag = None, None
+    # The snapshot latest.json points to may have expired; its bodies are then
+    # checked one by one, and the pointer is still replaced with IfMatch.
+    stored = set()
+    if latest:
+        try:
+            stored = set(get_json(latest["snapshot"])["files"].values())
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+                raise
+            print(f"[{name}] Latest snapshot {latest['snapshot']} is missing")
+
+    files = dict(files, **fill_sha256(prefix, files))
+    hashes = {fname: entry["sha256"] for fname, entry in files.items()}
+    # One copy per distinct body, even if several files share it
+    sources = {digest: prefix + fname for fname, digest in hashes.items() if digest not in stored}
+    with ThreadPoolExecutor(max_workers=max(1, SYNC_WORKERS)) as pool:
+        copied = sum(pool.map(lambda item: store_blob(*item), sources.items()))
+
+    snapshot_key = f"{root}snapshots/{plan['created_at']}.json"
+    put_json(snapshot_key, {
+        "dataset": name,
+        "prefix": prefix,
+        "generation": plan["generation"],
+        "created_at": plan["created_at"],
+        "objects": f"{SNAPSHOT_PREFIX}objects/",
+        "files": dict(sorted(hashes.items())),
+    })
+
+    if latest and latest.get("created_at", "") > plan["created_at"]:
+        print(f"[{name}] Snapshot {snapshot_key} is older than latest; pointer left alone")
+        return snapshot_key
+    condition = {"IfMatch": latest_etag} if latest_etag else {"IfNoneMatch": "*"}
+    try:
+        s3.put_object(
+            Bucket=BUCKET, Key=latest_key,
+            Body=json.dumps({"snapshot": snapshot_key, "created_at": plan["created_at"]}),
+            ContentType="application/json", **condition
+        )
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("PreconditionFailed", "ConditionalRequestConflict"):
+            raise
+        print(f"[{name}] latest.json changed during the snapshot; pointer left alone")
+    print(f"[{name}] Snapshot {snapshot_key}: {len(hashes)} file(s), {copied} new object(s)")
+    return snapshot_key
+
+def checkpoint_usable(checkpoint, resuming, now):
+    """
+    True if a checkpoint's completed files can be skipped: always when this
+    invocation resumes the sync that wrote it, otherwise only while the
+    sync it belongs to started less than CHECKPOINT_MAX_AGE_HOURS ago.
+    """
+    if resuming:
         return True
+    try:
+        started_at = datetime.fromisoformat(checkpoint.get("started_at") or checkpoint["created_at"])
+    except (KeyError, TypeError, ValueError):
+        return False
+    return now - started_at < timedelta(hours=CHECKPOINT_MAX_AGE_HOURS)
+
+def sync_dataset(dataset, deadline=None, nested_prefixes=(), resuming=False):
+    """
+    Sync one dataset's files from the BLS server to its S3 prefix,
+    uploading new or changed files, and deleting removed files. Large
+    datasets are handed to fan-out workers when a work queue is configured.
+    Otherwise files not started before the deadline are checkpointed for
+    the next invocation, which skips them if it is a resume (resuming) or
+    the checkpoint is recent. Returns a summary dict: "ok", the per-action
+    "summary", and the number of "failed", "deleted" and "pending" files.
+    """
+    name = dataset["name"]
+    plan = sync_plan(dataset, nested_prefixes)
+    checkpoint = load_checkpoint(dataset["checkpoint_key"]) or {}
+    stale_checkpoint = bool(checkpoint) and not checkpoint_usable(
+        checkpoint, resuming, datetime.fromisoformat(plan["created_at"])
+    )
+    if stale_checkpoint:
+        print(f"[{name}] Ignoring checkpoint from {checkpoint.get('created_at')}; revalidating every file")
+        checkpoint = {}
+
+    if SYNC_QUEUE_URL and SYNC_SHARDS > 1 and len(plan["remote"]) >= FANOUT_MIN_FILES:
+        # Every file is re-checked by the workers, so an older checkpoint is moot
+        if checkpoint:
+            s3.delete_object(Bucket=BUCKET, Key=dataset["checkpoint_key"])
+        return fan_out(plan)
+
+    # Continue an unfinished sync: skip the files it already completed and
+    # start with the ones it left pending.
+    remote_files = plan["remote"]
+    completed = set(checkpoint.get("completed", []))
+    pending_first = [f for f in checkpoint.get("pending", []) if f in remote_files]
+    if checkpoint:
+        print(f"[{name}] Resuming from checkpoint: {len(completed)} done, {len(pending_first)} pending")
+    ordered = pending_first + [f for f in remote_files if f not in pending_first]
+    to_sync = {f: remote_files[f] for f in ordered if f not in completed}
+
+    results, errors, entries = run_transfers(
+        to_sync, plan["records"], deadline=deadline, prefix=dataset["prefix"], url=dataset["url"]
+    )
+    pending = [f for f in to_sync if f not in results and f not in errors]
+    outcome = commit_sync(plan, results, errors, entries)
+
+    if pending:
+        print(f"⏳ [{name}] Out of time with {len(pending)} file(s) pending; checkpointing")
+        s3.put_object(
+            Bucket=BUCKET, Key=dataset["checkpoint_key"],
+            Body=json.dumps({
+                "created_at": plan["created_at"],
+                "started_at": checkpoint.get("started_at") or checkpoint.get("created_at") or plan["created_at"],
+                "completed": sorted(completed | set(results)),
+                "pending": pending,
+            }),
+            ContentType="application/json"
+        )
+    elif checkpoint or stale_checkpoint:
+        s3.delete_object(Bucket=BUCKET, Key=dataset["checkpoint_key"])
+    outcome["pending"] = len(pending)
+    return outcome
+
+def shard_files(remote_files, count):
+    """
+    Split {filename: remote} into at most count shards of similar total
+    size, placing the largest files first, each on the lightest shard.
+    Every file also counts one byte so files of unknown size spread evenly.
+    """
+    shards = [{} for _ in range(max(1, count))]
+    heap = [(0, i) for i in range(len(shards))]
+    by_size = sorted(remote_files.items(), key=lambda item: -(item[1].get("size") or 0))
+    for fname, remote in by_size:
+        total, i = heapq.heappop(heap)
+        shards[i][fname] = remote
+        heapq.heappush(heap, (total + (remote.get("size") or 0) + 1, i))
+    return [shard for shard in shards if shard]
+
+def put_json(key, value):
+    """
+    Write a run object; datetimes are stored as ISO 8601 strings.
+    """
+    s3.put_object(
+        Bucket=BUCKET, Key=key,
+        Body=json.dumps(value, default=lambda v: v.isoformat(), sort_keys=True),
+        ContentType="application/json"
+    )
+
+def get_json(key):
+    return json.loads(s3.get_object(Bucket=BUCKET, Key=key)["Body"].read())
+
+def parse_times(entries, field):
+    """
+    Turn the ISO 8601 strings put_json wrote for a datetime field back into
+    datetimes, in place.
+    """
+    for entry in entries.values():
+        if entry.get(field):
+            entry[field] = datetime.fromisoformat(entry[field])
+    return entries
+
+def store_run(plan):
+    """
+    Store a plan and its size-balanced shards under the dataset's runs
+    prefix, for workers to pick up. Shards live in S3 rather than in queue
+    messages or state machine payloads, which are limited to 256 KB.
+    Returns the run's S3 prefix and its number of shards.
+    """
+    dataset = plan["dataset"]
+    run_id = f"{plan['created_at'][:19].replace(':', '')}-{uuid.uuid4().hex[:8]}"
+    run = f"{dataset['runs_prefix']}{run_id}/"
+    shards = shard_files(plan["remote"], SYNC_SHARDS)
+    prefix = dataset["prefix"]
+
+    put_json(run + "plan.json", dict(plan, shards=len(shards)))
+    for index, shard in enumerate(shards):
+        put_json(f"{run}shard-{index:04d}.json", {
+            "files": shard,
+            "records": {prefix + f: plan["records"][prefix + f] for f in shard if prefix + f in plan["records"]},
+        })
+    return run, len(shards)
+
+def fan_out(plan):
+    """
+    Coordinator side of fan-out mode: store the run and queue one message
+    per shard. The worker that completes the last shard commits the run.
+    """
+    dataset = plan["dataset"]
+    run, count = store_run(plan)
+    run_id = run.rstrip("/").rsplit("/", 1)[-1]
+    messages = [
+        {"Id": str(index), "MessageBody": json.dumps({"run": run, "shard": index})}
+        for index in range(count)
+    ]
+    try:
+        sqs = boto3.client("sqs")
+        for i in range(0, len(messages), SQS_BATCH_SIZE):
+            response = sqs.send_message_batch(QueueUrl=SYNC_QUEUE_URL, Entries=messages[i:i + SQS_BATCH_SIZE])
+            if response.get("Failed"):
+                raise RuntimeError(f"SQS rejected {len(response['Failed'])} shard message(s)")
+    except Exception:
+        # Workers of shards already queued find no plan and skip them
+        delete_s3_keys(list_s3_objects(BUCKET, run))
+        raise
+    print(f"[{dataset['name']}] Fanned out {len(plan['remote'])} file(s) to {count} worker(s) as run {run_id}")
+    return {"ok": True, "run": run_id, "shards": count, "pending": 0}
+
+def claim_commit(run):
+    """
+    Atomically claim the right to commit a run, so that of several workers
+    seeing every shard result only one deletes files and writes the manifest.
+    """
+    try:
+        s3.put_object(Bucket=BUCKET, Key=run + "commit.json", Body=b"{}", IfNoneMatch="*")
+        return True
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("PreconditionFailed", "ConditionalRequestConflict"):
+            return False
+        raise
+
+def release_commit(run):
+    """
+    Give up the claim on a run whose commit failed, so the redelivered
+    shard message (or a later commit step) can claim and commit it again.
+    """
+    s3.delete_object(Bucket=BUCKET, Key=run + "commit.json")
+
+def process_shard(message, context=None):
+    """
+    Worker side of fan-out mode: transfer one shard's files, store its
+    result and, if every shard of the run has reported, commit the run.
+    Messages with "commit": false leave the commit to a separate step.
+    Files not started before the Lambda deadline are left for the next run.
+    Returns False if the run no longer exists.
+    """
+    run, index = message["run"], message["shard"]
+    try:
+        plan = get_json(run + "plan.json")
+        shard = get_json(f"{run}shard-{index:04d}.json")
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            print(f"Skipping shard {index} of {run}: run already committed or abandoned")
+            return False
+        raise
+    dataset = plan["dataset"]
+    remote_files = parse_times(shard["files"], "mtime")
+    results, errors, entries = run_transfers(
+        remote_files, parse_times(shard["records"], "last_modified"),
+        deadline=sync_deadline(context), prefix=dataset["prefix"], url=dataset["url"]
+    )
+    pending = [f for f in remote_files if f not in results and f not in errors]
+    if pending:
+        print(f"⏳ [{dataset['name']}] {len(pending)} file(s) of shard {index} left for the next run")
+    put_json(f"{run}result-{index:04d}.json", {"results": results, "errors": errors, "entries": entries})
+
+    if not message.get("commit", True):
+        return True
+    reported = list_s3_objects(BUCKET, run + "result-")
+    if len(reported) >= plan["shards"] and claim_commit(run):
+        try:
+            commit_run(run, plan, reported)
+        except Exception:
+            release_commit(run)
+            raise
+    return True
+
+def commit_run(run, plan=None, reported=None):
+    """
+    Merge the shard results of a run, commit them with commit_sync and
+    remove the run's objects. Shards that never reported keep their files'
+    previous manifest entries. Returns the dataset's summary dict, or None
+    if the run no longer exists.
+    """
+    try:
+        plan = plan or get_json(run + "plan.json")
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            return None
+        raise
+    if reported is None:
+        reported = list_s3_objects(BUCKET, run + "result-")
+
+    results, errors, entries = {}, {}, {}
+    for key in sorted(reported):
+        shard_result = get_json(key)
+        results.update(shard_result["results"])
+        errors.update(shard_result["errors"])
+        entries.update(shard_result["entries"])
+    outcome = commit_sync(plan, results, errors, entries)
+    print(json.dumps({"bls_datasets": {plan["dataset"]["name"]: dict(outcome, run=run)}}, sort_keys=True))
+    delete_s3_keys(list_s3_objects(BUCKET, run))
+    return outcome
+
+def plan_runs(datasets=None):
+    """
+    Plan step of the state machine: store a run for every dataset in the
+    registry (or only the named ones) and return the run prefixes and one
+    {"run", "shard"} item per shard for the Map state. Datasets with
+    nothing to transfer are committed straight away.
+    """
+    registry = select_datasets(datasets)
+    runs, shards = [], []
+    for dataset in registry:
+        plan = sync_plan(dataset, nested_prefixes(dataset, registry))
+        if not plan["remote"]:
+            commit_sync(plan, {}, {}, {})
+            continue
+        run, count = store_run(plan)
+        runs.append(run)
+        shards.extend({"run": run, "shard": index, "commit": False} for index in range(count))
+    return {"runs": runs, "shards": shards}
+
+def select_datasets(datasets=None):
+    """
+    Return the registry, limited to the named datasets if given.
+    """
+    registry = load_datasets()
+    if datasets is not None:
+        registry = [d for d in registry if d["name"] in datasets]
+    return registry
+
+def nested_prefixes(dataset, registry):
+    """
+    Prefixes of the other datasets nested under this one's (e.g. bls-data/ce/
+    under bls-data/), whose objects are not this dataset's to reconcile.
+    """
+    return [
+        d["prefix"] for d in registry
+        if d is not dataset and d["prefix"].startswith(dataset["prefix"])
+    ]
+
+def sync_bls(context=None, resume_count=0, datasets=None):
+    """
+    Sync every dataset in the BLS_DATASETS registry (or only the named
+    ones) to S3, up to DATASET_WORKERS at a time in priority order, and log
+    a per-dataset summary. When the Lambda context shows the timeout is
+    near, datasets stop starting new files, checkpoint the ones still
+    pending and the function re-invokes itself for those datasets.
+    Returns True only if every dataset synced without errors.
+    """
+    try:
+        registry = select_datasets(datasets)
+        deadline = sync_deadline(context)
+
+        def run(dataset):
+            try:
+                return sync_dataset(
+                    dataset, deadline, nested_prefixes(dataset, registry), resuming=resume_count > 0
+                )
+            except Exception as e:
+                print(f"[{dataset['name']}] sync error: {e}")
+                return {"ok": False, "error": str(e), "pending": 0}
+
+        # The pool starts datasets in registry order, so higher priorities
+        # get the shared connections first.
+        with ThreadPoolExecutor(max_workers=max(1, min(DATASET_WORKERS, len(registry) or 1))) as pool:
+            results = dict(zip((d["name"] for d in registry), pool.map(run, registry)))
+        print(json.dumps({"bls_datasets": results}, sort_keys=True))
+
+        pending = [name for name, result in results.items() if result["pending"]]
+        if pending and not resume_sync(context, resume_count, pending):
+            print("Remaining files will be synced on the next run")
+        return all(result["ok"] for result in results.values())
 
     except Exception as e:
         print(f"sync_bls error: {e}")
         return False
 
-def load_population_to_s3():
+def canonical_hash(data):
+    """
+    Return a SHA-256 hex digest of a JSON value that does not depend on key
+    order or whitespace, so re-serializing identical data gives the same hash.
+    """
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def stored_content_hash(key):
     """
-    Fetch population data JSON from API and upload it as JSON to S3.
+    Return the content hash recorded in an object's metadata, or None if the
+    object does not exist or has none.
     """
     try:
-        response = requests.get(POP_URL)
-        response.raise_for_status()
-        data = response.json()
-        json_data = json.dumps(data)
-        s3.put_object(Bucket=BUCKET, Key=POP_S3_KEY, Body=json_data, ContentType='application/json')
+        return s3.head_object(Bucket=BUCKET, Key=key).get("Metadata", {}).get(CONTENT_HASH_METADATA)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404", "NotFound"):
+            return None
+        raise
+
+# Cached population response of this container, and the refresh in flight
+population_cache = {}
+population_cache_lock = threading.Lock()
+population_refresh_pool = ThreadPoolExecutor(max_workers=1)
+population_refresh = None
+
+def load_population_cache():
+    """
+    Return the cached population response {"body", "etag", "last_modified",
+    "fetched_at"} from memory or, in a cold container, from S3; None if
+    nothing was cached yet.
+    """
+    with population_cache_lock:
+        if population_cache:
+            return dict(population_cache)
+    try:
+        response = s3.get_object(Bucket=BUCKET, Key=POP_CACHE_KEY)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            return None
+        raise
+    metadata = response.get("Metadata", {})
+    entry = {
+        "body": response["Body"].read(),
+        "etag": metadata.get("etag"),
+        "last_modified": metadata.get("last-modified"),
+        "fetched_at": float(metadata.get("fetched-at", 0)),
+    }
+    with population_cache_lock:
+        population_cache.update(entry)
+    return entry
+
+def store_population_cache(entry):
+    metadata = {"etag": entry["etag"], "last-modified": entry["last_modified"], "fetched-at": str(entry["fetched_at"])}
+    s3.put_object(
+        Bucket=BUCKET, Key=POP_CACHE_KEY, Body=entry["body"], ContentType="application/json",
+        Metadata={k: v for k, v in metadata.items() if v}
+    )
+    with population_cache_lock:
+        population_cache.clear()
+        population_cache.update(entry)
+
+def refresh_population(cached):
+    """
+    Fetch POP_URL, conditionally on the cached copy's validators, store the
+    result as the new cached copy and return it. A 304 keeps the cached body.
+    """
+    headers = dict(HEADERS)
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+    response = origin_get(POP_URL, headers=headers, timeout=POP_TIMEOUT)
+    try:
+        if cached and response.status_code == 304:
+            entry = dict(cached, fetched_at=time.time())
+        else:
+            response.raise_for_status()
+            entry = {
+                "body": response.content,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "fetched_at": time.time(),
+            }
+    finally:
+        response.close()
+    store_population_cache(entry)
+    return entry
+
+def population_body():
+    """
+    Return the population API's JSON body through the stale-while-revalidate
+    cache. Only a cold cache waits for the API without a bound.
+    """
+    global population_refresh
+    cached = load_population_cache()
+    if cached and time.time() - cached["fetched_at"] < POP_CACHE_TTL_SECONDS:
+        return cached["body"]
+
+    with population_cache_lock:
+        if population_refresh is None or population_refresh.done():
+            population_refresh = population_refresh_pool.submit(refresh_population, cached)
+        future = population_refresh
+    if cached is None:
+        return future.result()["body"]
+    try:
+        return future.result(timeout=POP_REFRESH_WAIT_SECONDS)["body"]
+    except FutureTimeout:
+        print(f"Population API slower than {POP_REFRESH_WAIT_SECONDS}s; using the cached copy")
+    except Exception as e:
+        print(f"Population API refresh failed ({e}); using the cached copy")
+    return cached["body"]
+
+def load_nation_population():
+    """
+    Fetch the nation-level population data the report reads (through the
+    population_body cache) and upload the API's JSON body to S3 as is. The
+    upload is skipped when the data's canonical hash matches the one stored
+    with the current object, since every PUT of the key triggers a report run.
+    """
+    try:
+        body = population_body()
+        content_hash = canonical_hash(json.loads(body))
+        # Written first, so the report the PUT triggers finds a fresh copy;
+        # checked on unchanged days too, so a missing copy is filled in. The
+        # copy is optional: the report falls back to the raw JSON without it.
+        if PARQUET and pandas_module() is not None:
+            try:
+                materialize_parquet(POP_S3_KEY, content_hash, population_frame, body=body)
+            except Exception as e:
+                print(f"❌ Parquet copy of {POP_S3_KEY} failed: {e}")
+        if stored_content_hash(POP_S3_KEY) == content_hash:
+            print(f"✅ Population data unchanged; s3://{BUCKET}/{POP_S3_KEY} left as is")
+            return True
+        s3.put_object(
+            Bucket=BUCKET, Key=POP_S3_KEY, Body=body, ContentType='application/json',
+            Metadata={CONTENT_HASH_METADATA: content_hash}
+        )
         print(f"Uploaded data to s3://{BUCKET}/{POP_S3_KEY}")
         return True
     except Exception as e:
-        print(f"load_population_to_s3 error: {e}")
+        print(f"load_nation_population error: {e}")
+        return False
+
+def population_page_url(geography, offset):
+    query = urlencode({
+        "cube": POP_CUBE,
+        "drilldowns": f"Year,{geography}",
+        "locale": "en",
+        "measures": "Population",
+        "limit": f"{POP_PAGE_SIZE},{offset}",
+    })
+    return f"{POP_API_URL}?{query}"
+
+def fetch_population_page(geography, offset):
+    """
+    Return (records, total) for one page of a drilldown; total is None if
+    the API does not report it.
+    """
+    response = origin_get(population_page_url(geography, offset))
+    try:
+        response.raise_for_status()
+        page = response.json()
+    finally:
+        response.close()
+    return page.get("data", []), (page.get("page") or {}).get("total")
+
+def population_records(geography):
+    """
+    Yield a drilldown's records in order, one page at a time. When the first
+    page reports the total, the following pages are fetched up to
+    POP_PREFETCH_PAGES ahead; otherwise paging stops at the first short page.
+    At most that many pages are held in memory.
+    """
+    data, total = fetch_population_page(geography, 0)
+    yield from data
+    if total is None:
+        offset = 0
+        while len(data) == POP_PAGE_SIZE:
+            offset += POP_PAGE_SIZE
+            data, _ = fetch_population_page(geography, offset)
+            yield from data
+        return
+
+    offsets = iter(range(POP_PAGE_SIZE, total, POP_PAGE_SIZE))
+    with ThreadPoolExecutor(max_workers=max(1, POP_PREFETCH_PAGES)) as pool:
+        window = deque(
+            pool.submit(fetch_population_page, geography, offset)
+            for offset in islice(offsets, max(1, POP_PREFETCH_PAGES))
+        )
+        while window:
+            data, _ = window.popleft().result()
+            offset = next(offsets, None)
+            if offset is not None:
+                window.append(pool.submit(fetch_population_page, geography, offset))
+            yield from data
+
+def ndjson_chunks(records):
+    """
+    Encode records as newline-delimited JSON, yielding chunks of about
+    CHUNK_SIZE bytes.
+    """
+    buffer = bytearray()
+    for record in records:
+        buffer.extend(json.dumps(record, separators=(",", ":")).encode("utf-8"))
+        buffer.extend(b"\n")
+        if len(buffer) >= CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+def load_population_geography(geography):
+    """
+    Stream one population drilldown to S3 as NDJSON through upload_chunks,
+    which uploads it in parts and leaves an identical object untouched.
+    """
+    key = f"{POP_NDJSON_PREFIX}{geography.lower()}.ndjson"
+    try:
+        try:
+            head = s3.head_object(Bucket=BUCKET, Key=key, ChecksumMode="ENABLED")
+            existing = {"checksum": head.get("ChecksumSHA256"), "etag": head["ETag"].strip('"')}
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404", "NotFound"):
+                raise
+            existing = None
+        result = upload_chunks(
+            ndjson_chunks(population_records(geography)), key,
+            existing=existing, content_type="application/x-ndjson"
+        )
+        state = "Uploaded" if result["written"] else "✅ Unchanged:"
+        print(f"{state} s3://{BUCKET}/{key} ({result['size']} bytes)")
+        return True
+    except Exception as e:
+        print(f"load_population_geography({geography}) error: {e}")
         return False
 
+def load_population_to_s3():
+    """
+    Load the nation-level population JSON and every POP_GEOGRAPHIES
+    drilldown concurrently. Returns True only if all of them succeeded.
+    """
+    loaders = [(load_nation_population,)] + [(load_population_geography, g) for g in POP_GEOGRAPHIES]
+    with ThreadPoolExecutor(max_workers=len(loaders)) as pool:
+        results = list(pool.map(lambda loader: loader[0](*loader[1:]), loaders))
+    return all(results)
+
+def timed_task(name, fn, *args):
+    """
+    Run one ingest task, logging how long it took. An unexpected exception
+    counts as a failed task rather than failing the invocation.
+    """
+    started = time.monotonic()
+    try:
+        result = fn(*args)
+    except Exception as e:
+        print(f"{name} error: {e}")
+        result = False
+    print(f"{name} finished in {time.monotonic() - started:.1f}s (success: {result})")
+    return result
+
 def main(event, context):
     """
-    Lambda entrypoint: runs BLS sync and population data load sequentially,
-    returns combined status.
+    Lambda entrypoint: runs BLS sync and population data load concurrently,
+    returns combined status. They use different origins and S3 keys, so the
+    population upload (which triggers the report) does not wait for the BLS
+    sync. Invocations that resume an unfinished BLS sync only run the sync.
+    Events with a "step" are state machine tasks, handled by step().
     """
-    bls_result = sync_bls()
-    pop_result = load_population_to_s3()
+    event = event or {}
+    if "step" in event:
+        return step(event, context)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        bls_future = pool.submit(
+            timed_task, "sync_bls", sync_bls,
+            context, event.get("resume_count", 0), event.get("datasets")
+        )
+        if event.get("resume"):
+            pop_future = None
+        else:
+            pop_future = pool.submit(timed_task, "load_population_to_s3", load_population_to_s3)
+        bls_result = bls_future.result()
+        pop_result = pop_future.result() if pop_future else True
     status_code = 200 if bls_result and pop_result else 500
 
     return {
@@ -125,4 +2180,39 @@ def main(event, context):
             "bls_sync": bls_result,
             "population_upload_success": pop_result
         }),
-    }
\ No newline at end of file
+    }
+
+def step(event, context):
+    """
+    Task body of the optional Step Functions orchestration. event["step"]
+    selects "plan", "commit" or "population"; shards go to worker(). Failures
+    raise, so the state machine's retry policy applies.
+    """
+    name = event["step"]
+    if name == "plan":
+        return plan_runs(event.get("datasets"))
+    if name == "commit":
+        outcomes = {run: commit_run(run) for run in event.get("runs", [])}
+        return {"ok": all(o is None or o["ok"] for o in outcomes.values())}
+    if name == "population":
+        if not load_population_to_s3():
+            raise RuntimeError("Population load failed")
+        return {"ok": True}
+    raise ValueError(f"Unknown step: {name}")
+
+def worker(event, context):
+    """
+    SQS entrypoint of the fan-out workers: processes each shard message and
+    reports the failed ones, so only those are redelivered. A state machine
+    Map iteration passes a single shard item instead.
+    """
+    if "run" in event:
+        return {"processed": process_shard(event, context)}
+    failures = []
+    for record in event.get("Records", []):
+        try:
+            process_shard(json.loads(record["body"]), context)
+        except Exception as e:
+            print(f"worker error on {record.get('messageId')}: {e}")
+            failures.append({"itemIdentifier": record["messageId"]})
+    return {"batchItemFailures": failures}
\ No newline at end of file
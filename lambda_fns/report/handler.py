@@ -1,7 +1,11 @@
 import json
 import pandas as pd
 import boto3
-from io import StringIO
+import gzip
+import hashlib
+import math
+from botocore.exceptions import ClientError
+from io import BytesIO, StringIO
 import os
 import re
 
@@ -11,6 +15,113 @@ BUCKET = os.environ["BUCKET_NAME"]
 PR_KEY = "bls-data/pr.data.0.Current"
 POP_KEY = "datausa/acs_population.json"
 
+# Typed Parquet copies written by the ingest Lambda; their "source-tag"
+# metadata names the raw object version (ETag or content hash) they were
+# built from.
+PARQUET_PREFIX = "parquet/"
+PR_COLUMNS = ['series_id', 'year', 'period', 'value']
+
+# Default year window of the population stats; events may pass start_year
+# and end_year
+DEFAULT_START_YEAR = 2013
+DEFAULT_END_YEAR = 2018
+
+def read_s3_body(key):
+    """
+    Read an object from S3, decompressing it if the ingest Lambda stored it
+    with Content-Encoding: gzip.
+    """
+    response = s3.get_object(Bucket=BUCKET, Key=key)
+    body = response['Body'].read()
+    if response.get('ContentEncoding') == 'gzip':
+        body = gzip.decompress(body)
+    return body
+
+def read_parquet(raw_key, columns=None):
+    """
+    Load the ingest Lambda's Parquet copy of raw_key, reading only the given
+    columns. Returns None if there is no copy or it was built from an older
+    version of the raw object, so the caller parses the raw object instead.
+    """
+    try:
+        response = s3.get_object(Bucket=BUCKET, Key=f"{PARQUET_PREFIX}{raw_key}.parquet")
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+            return None
+        raise
+    raw = s3.head_object(Bucket=BUCKET, Key=raw_key)
+    current = {raw['ETag'].strip('"'), raw.get('Metadata', {}).get('content-sha256')}
+    if response.get('Metadata', {}).get('source-tag') not in current:
+        print(f"Parquet copy of {raw_key} is stale; reading the raw object")
+        return None
+    df = pd.read_parquet(BytesIO(response['Body'].read()), columns=columns)
+    df.attrs['source_tag'] = response['Metadata']['source-tag']
+    return df
+
+class PopulationStats:
+    """
+    Prefix sums of population per year, answering mean and standard
+    deviation for any inclusive year window in O(1). Years are indexed
+    densely from the first one; values are offset by the first population to
+    keep the sum of squares from cancelling out.
+    """
+
+    def __init__(self, years, populations):
+        pairs = sorted(zip(years, populations))
+        self.first_year = pairs[0][0] if pairs else 0
+        self.last_year = pairs[-1][0] if pairs else -1
+        self.shift = pairs[0][1] if pairs else 0.0
+        size = self.last_year - self.first_year + 1
+        count, total, squares = [0] * (size + 1), [0.0] * (size + 1), [0.0] * (size + 1)
+        for year, population in pairs:
+            i = year - self.first_year + 1
+            count[i] += 1
+            total[i] += population - self.shift
+            squares[i] += (population - self.shift) ** 2
+        for i in range(1, size + 1):
+            count[i] += count[i - 1]
+            total[i] += total[i - 1]
+            squares[i] += squares[i - 1]
+        self.count, self.total, self.squares = count, total, squares
+
+    @classmethod
+    def from_frame(cls, pop_df):
+        return cls(pop_df['year'].astype(int).tolist(), pop_df['population'].astype(float).tolist())
+
+    def window(self, start_year, end_year):
+        """
+        Return (count, mean, sample standard deviation) of the populations
+        from start_year to end_year inclusive; mean and std are None when
+        there are too few values, as pandas would return NaN.
+        """
+        lo = min(max(start_year, self.first_year), self.last_year + 1) - self.first_year
+        hi = max(min(end_year, self.last_year), self.first_year - 1) - self.first_year + 1
+        if hi <= lo:
+            return 0, None, None
+        n = self.count[hi] - self.count[lo]
+        if n == 0:
+            return 0, None, None
+        total = self.total[hi] - self.total[lo]
+        squares = self.squares[hi] - self.squares[lo]
+        mean = self.shift + total / n
+        if n < 2:
+            return n, mean, None
+        variance = max(0.0, (squares - total * total / n) / (n - 1))
+        return n, mean, math.sqrt(variance)
+
+# PopulationStats of the last population version seen by this container
+stats_cache = {}
+
+def population_stats(pop_df, version):
+    """
+    Return the PopulationStats for a population version, building it only
+    when the version changes.
+    """
+    if version not in stats_cache:
+        stats_cache.clear()
+        stats_cache[version] = PopulationStats.from_frame(pop_df)
+    return stats_cache[version]
+
 def main(event, context):
     pr_dtypes = {
         'series_id': str,
@@ -21,37 +132,44 @@ def main(event, context):
     }
 
     # ---------- Load Time-Series Data ----------
-    response = s3.get_object(Bucket=BUCKET, Key=PR_KEY)
-    body = response['Body'].read().decode('utf-8')
-    pr_df = pd.read_csv(StringIO(body), sep='\t', dtype=pr_dtypes)
+    pr_df = read_parquet(PR_KEY, columns=PR_COLUMNS)
+    if pr_df is None:
+        body = read_s3_body(PR_KEY).decode('utf-8')
+        pr_df = pd.read_csv(StringIO(body), sep='\t', dtype=pr_dtypes)
 
-    pr_df.columns = pr_df.columns.str.strip()
-    pr_df = pr_df.map(lambda x: x.strip() if isinstance(x, str) else x)
+        pr_df.columns = pr_df.columns.str.strip()
+        pr_df = pr_df.map(lambda x: x.strip() if isinstance(x, str) else x)
 
     # ---------- Load Population JSON ----------
-    response = s3.get_object(Bucket=BUCKET, Key=POP_KEY)
-    population_json = json.loads(response['Body'].read())
-    pop_df = pd.DataFrame(population_json['data'])
-
-    pop_df = pop_df.astype({
-        'Nation ID': str,
-        'Nation': str,
-        'Year': int,
-        'Population': float
-    })
-
-    pop_df.columns = pop_df.columns.str.strip()
-    pop_df.columns = pop_df.columns.map(
-        lambda col: re.sub(r'\W+', '_', col.strip()).replace(' ', '_').lower()
-    )
-    pop_df = pop_df.map(lambda x: x.strip() if isinstance(x, str) else x)
-
-    # ---------- Section 1: Population Stats (2013–2018) ----------
-    filtered_pop_df = pop_df[(pop_df["year"] > 2012) & (pop_df["year"] < 2019)]
-    mean_population = filtered_pop_df["population"].mean()
-    std_population = filtered_pop_df["population"].std()
-
-    print("\n--- Population Stats (2013–2018) ---")
+    pop_df = read_parquet(POP_KEY)
+    if pop_df is not None:
+        pop_version = pop_df.attrs['source_tag']
+    else:
+        pop_body = read_s3_body(POP_KEY)
+        pop_version = hashlib.sha256(pop_body).hexdigest()
+        population_json = json.loads(pop_body)
+        pop_df = pd.DataFrame(population_json['data'])
+
+        pop_df = pop_df.astype({
+            'Nation ID': str,
+            'Nation': str,
+            'Year': int,
+            'Population': float
+        })
+
+        pop_df.columns = pop_df.columns.str.strip()
+        pop_df.columns = pop_df.columns.map(
+            lambda col: re.sub(r'\W+', '_', col.strip()).replace(' ', '_').lower()
+        )
+        pop_df = pop_df.map(lambda x: x.strip() if isinstance(x, str) else x)
+
+    # ---------- Section 1: Population Stats (default 2013–2018) ----------
+    event = event if isinstance(event, dict) else {}
+    start_year = int(event.get("start_year", DEFAULT_START_YEAR))
+    end_year = int(event.get("end_year", DEFAULT_END_YEAR))
+    _, mean_population, std_population = population_stats(pop_df, pop_version).window(start_year, end_year)
+
+    print(f"\n--- Population Stats ({start_year}–{end_year}) ---")
     print("Mean:", mean_population)
     print("Standard Deviation:", std_population)
 
@@ -80,8 +198,10 @@ def main(event, context):
             "status": "success",
             "details": "Data processing completed and results are available.",
             "population_summary": {
-                "average": round(mean_population),
-                "standard_deviation": round(std_population)
+                "start_year": start_year,
+                "end_year": end_year,
+                "average": round(mean_population) if mean_population is not None else None,
+                "standard_deviation": round(std_population) if std_population is not None else None
             },
             "top_yearly_values": best_years.to_dict(orient="records"),
             "series_population_data": final_report.to_dict(orient="records")
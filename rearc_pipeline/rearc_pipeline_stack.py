@@ -1,6 +1,7 @@
-from aws_cdk import Duration
+from aws_cdk import ArnFormat, Duration
 from aws_cdk import (
     Stack,
+    aws_iam as iam,
     aws_lambda as _lambda,
     aws_s3 as s3,
     aws_sqs as sqs,
@@ -11,13 +12,22 @@ from aws_cdk import (
     aws_sns as sns,
     aws_sns_subscriptions as subscriptions,
     aws_cloudwatch as cloudwatch,
-    aws_cloudwatch_actions as cloudwatch_actions
+    aws_cloudwatch_actions as cloudwatch_actions,
+    aws_stepfunctions as sfn,
+    aws_stepfunctions_tasks as tasks
 )
 from constructs import Construct
 
 class RearcPipelineStack(Stack):
 
-    def __init__(self, scope: Construct, construct_id: str, environment: str, **kwargs) -> None:
+    def __init__(self, scope: Construct, construct_id: str, environment: str,
+                 use_step_functions: bool = False, map_max_concurrency: int = 8, **kwargs) -> None:
+        """
+        With use_step_functions, the daily schedule starts a state machine
+        (plan, Map over sync shards with map_max_concurrency, commit, in
+        parallel with the population load, then the report) instead of
+        invoking the ingest Lambda and reporting on the population PUT.
+        """
         super().__init__(scope, construct_id, **kwargs)
 
         bucket_name = "rearc-dev-datalake" if environment == "dev" else "rearc-prod-datalake"
@@ -29,6 +39,18 @@ class RearcPipelineStack(Stack):
             visibility_timeout=Duration.seconds(310)
         )
 
+        # Fan-out work queue: one message per shard of a large BLS sync.
+        # Shards that keep failing are set aside instead of retried forever.
+        sync_dlq = sqs.Queue(
+            self, "BlsSyncShardDLQ",
+            retention_period=Duration.days(14)
+        )
+        sync_queue = sqs.Queue(
+            self, "BlsSyncShardQueue",
+            visibility_timeout=Duration.seconds(310),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=3, queue=sync_dlq)
+        )
+
         common_layer = _lambda.LayerVersion(
             self, "DependenciesLayer",
             code=_lambda.Code.from_asset("lambda_layer"),
@@ -41,17 +63,43 @@ class RearcPipelineStack(Stack):
             "arn:aws:lambda:ap-south-1:336392948345:layer:AWSSDKPandas-Python39:28"
         )
 
+        # pandas/pyarrow (Parquet copies, the report) take about 130 MB once
+        # imported, and each concurrent transfer buffers up to one multipart
+        # part, so the default 128 MB is not enough.
+        ingest_memory_mb = 1024
+        report_memory_mb = 1024
+
         ingest_fn = _lambda.Function(
             self, "IngestLambda",
             runtime=_lambda.Runtime.PYTHON_3_9,
             handler="handler.main",
             code=_lambda.Code.from_asset("lambda_fns/ingest"),
             timeout=Duration.minutes(5),
+            memory_size=ingest_memory_mb,
             environment={
                 "BUCKET_NAME": bucket.bucket_name,
-                "QUEUE_URL": queue.queue_url
+                "QUEUE_URL": queue.queue_url,
+                "SYNC_QUEUE_URL": sync_queue.queue_url,
+                "PARQUET": "true"
             },
-            layers=[common_layer]
+            layers=[common_layer, numpy_layer]
+        )
+
+        # Transfers the shards queued by the ingest Lambda; the worker that
+        # finishes a run's last shard also deletes removed files and writes
+        # the manifest.
+        ingest_worker_fn = _lambda.Function(
+            self, "IngestWorkerLambda",
+            runtime=_lambda.Runtime.PYTHON_3_9,
+            handler="handler.worker",
+            code=_lambda.Code.from_asset("lambda_fns/ingest"),
+            timeout=Duration.minutes(5),
+            memory_size=ingest_memory_mb,
+            environment={
+                "BUCKET_NAME": bucket.bucket_name,
+                "PARQUET": "true"
+            },
+            layers=[common_layer, numpy_layer]
         )
 
         report_fn = _lambda.Function(
@@ -60,6 +108,7 @@ class RearcPipelineStack(Stack):
             handler="handler.main",
             code=_lambda.Code.from_asset("lambda_fns/report"),
             timeout=Duration.minutes(5),
+            memory_size=report_memory_mb,
             environment={
                 "BUCKET_NAME": bucket.bucket_name
             },
@@ -67,25 +116,109 @@ class RearcPipelineStack(Stack):
         )
 
         bucket.grant_read_write(ingest_fn)
+        bucket.grant_read_write(ingest_worker_fn)
+        sync_queue.grant_send_messages(ingest_fn)
         bucket.grant_read(report_fn)
         queue.grant_send_messages(ingest_fn)
+
+        # Lets an unfinished BLS sync re-invoke itself from its checkpoint.
+        # The ARN is built from the stack name rather than ingest_fn.function_arn
+        # to avoid a dependency cycle between the function and its role policy.
+        ingest_fn.add_to_role_policy(iam.PolicyStatement(
+            actions=["lambda:InvokeFunction"],
+            resources=[self.format_arn(
+                service="lambda",
+                resource="function",
+                resource_name=f"{self.stack_name}-IngestLambda*",
+                arn_format=ArnFormat.COLON_RESOURCE_NAME
+            )]
+        ))
         queue.grant_consume_messages(report_fn)
 
         rule = events.Rule(
             self, "DailyIngestSchedule",
             schedule=events.Schedule.rate(Duration.days(1))
         )
-        rule.add_target(targets.LambdaFunction(ingest_fn))
 
-        notification = s3n.SqsDestination(queue)
-        bucket.add_event_notification(
-            s3.EventType.OBJECT_CREATED_PUT, 
-            notification,
-            s3.NotificationKeyFilter(prefix="datausa/acs_population.json")
-        )
+        if use_step_functions:
+            # Each task reuses a Lambda handler; failures and timeouts are
+            # retried with backoff before the execution fails.
+            def lambda_task(id, fn, payload, result_path, timeout):
+                task = tasks.LambdaInvoke(
+                    self, id,
+                    lambda_function=fn,
+                    payload=payload,
+                    payload_response_only=True,
+                    result_path=result_path,
+                    task_timeout=sfn.Timeout.duration(timeout)
+                )
+                task.add_retry(
+                    errors=["States.TaskFailed", "States.Timeout"],
+                    interval=Duration.seconds(10),
+                    max_attempts=2,
+                    backoff_rate=2
+                )
+                return task
+
+            task_timeout = Duration.minutes(6)
+            plan_task = lambda_task(
+                "PlanBlsSync", ingest_fn, sfn.TaskInput.from_object({"step": "plan"}), "$.plan", task_timeout
+            )
+            shard_task = lambda_task(
+                "SyncBlsShard", ingest_worker_fn, sfn.TaskInput.from_json_path_at("$"),
+                sfn.JsonPath.DISCARD, task_timeout
+            )
+            shards_map = sfn.Map(
+                self, "SyncBlsShards",
+                items_path="$.plan.shards",
+                max_concurrency=map_max_concurrency,
+                result_path=sfn.JsonPath.DISCARD
+            )
+            shards_map.item_processor(shard_task)
+            commit_task = lambda_task(
+                "CommitBlsSync", ingest_fn,
+                sfn.TaskInput.from_object({"step": "commit", "runs": sfn.JsonPath.list_at("$.plan.runs")}),
+                "$.commit", task_timeout
+            )
+            population_task = lambda_task(
+                "LoadPopulation", ingest_fn, sfn.TaskInput.from_object({"step": "population"}),
+                "$.population",
+                Duration.minutes(2)
+            )
+            report_task = lambda_task(
+                "RunReport", report_fn, sfn.TaskInput.from_object({}), "$.report", task_timeout
+            )
 
-        report_fn.add_event_source(
-            lambda_events.SqsEventSource(queue)
+            ingest = sfn.Parallel(self, "Ingest", result_path=sfn.JsonPath.DISCARD)
+            ingest.branch(plan_task.next(shards_map).next(commit_task))
+            ingest.branch(population_task)
+
+            state_machine = sfn.StateMachine(
+                self, "IngestReportStateMachine",
+                definition_body=sfn.DefinitionBody.from_chainable(ingest.next(report_task)),
+                timeout=Duration.hours(2)
+            )
+            rule.add_target(targets.SfnStateMachine(state_machine))
+        else:
+            rule.add_target(targets.LambdaFunction(ingest_fn))
+
+            notification = s3n.SqsDestination(queue)
+            bucket.add_event_notification(
+                s3.EventType.OBJECT_CREATED_PUT, 
+                notification,
+                s3.NotificationKeyFilter(prefix="datausa/acs_population.json")
+            )
+
+            report_fn.add_event_source(
+                lambda_events.SqsEventSource(queue)
+            )
+
+        ingest_worker_fn.add_event_source(
+            lambda_events.SqsEventSource(
+                sync_queue,
+                batch_size=1,
+                report_batch_item_failures=True
+            )
         )
 
         if environment == "dev":
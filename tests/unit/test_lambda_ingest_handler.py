@@ -1,41 +1,69 @@
 import json
+import base64
+import gzip
+import hashlib
+import io
 import os
 import pytest
+import threading
+import time
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
 from unittest.mock import patch, MagicMock
 
 # Set environment variable for testing
 with patch.dict(os.environ, {"BUCKET_NAME": "test-bucket"}):
     from lambda_fns.ingest import handler
 
+def no_manifest(mock_s3):
+    """Helper to make the mocked bucket report that no sync manifest exists"""
+    mock_s3.get_object.side_effect = ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+
+def serve_bls_index(mock_get, index_html):
+    """Helper to serve the BLS directory index, leaving mock_get.return_value for file downloads"""
+    index = MagicMock(headers={"Content-Type": "text/html"})
+    index.iter_content.return_value = [index_html.encode("utf-8")]
+    files = mock_get.return_value
+    mock_get.side_effect = lambda url, **kwargs: index if url == handler.BLS_URL else files
+
+def put_keys(mock_s3):
+    """Helper to list the keys written with s3.put_object()"""
+    return [kwargs["Key"] for _, kwargs in mock_s3.put_object.call_args_list]
+
 # Test for loading population data to S3
-@patch("lambda_fns.ingest.handler.requests.get")
+@patch.dict("lambda_fns.ingest.handler.population_cache", clear=True)
+@patch("lambda_fns.ingest.handler.http.get")
 @patch("lambda_fns.ingest.handler.s3")
 def test_load_population_to_s3(mock_s3, mock_get):
+    no_manifest(mock_s3)
     mock_get.return_value.status_code = 200
-    mock_get.return_value.json.return_value = {"data": "mocked"}
+    mock_get.return_value.content = b'{"data": "mocked"}'
 
     success = handler.load_population_to_s3()
     assert success
-    mock_s3.put_object.assert_called_once()
+    assert put_keys(mock_s3) == [handler.POP_CACHE_KEY, "datausa/acs_population.json"]
     args, kwargs = mock_s3.put_object.call_args
     assert kwargs["Bucket"] == "test-bucket"
     assert kwargs["Key"] == "datausa/acs_population.json"
 
 # Test for syncing BLS file when it's new
-@patch("lambda_fns.ingest.handler.requests.get")
+@patch("lambda_fns.ingest.handler.http.get")
 @patch("lambda_fns.ingest.handler.s3")
 def test_sync_bls_new_file(mock_s3, mock_get):
     mock_get.return_value.status_code = 200
-    mock_get.return_value.content = b"sample file content"
-    mock_get.return_value.text = """
+    mock_get.return_value.iter_content.return_value = [b"sample file content"]
+    serve_bls_index(mock_get, """
     <html><body><a href="pr.data.0.Current">Download</a></body></html>
-    """
+    """)
 
+    mock_get.return_value.headers = {"ETag": '"v1"'}
     mock_s3.get_paginator.return_value.paginate.return_value = []
+    mock_s3.put_object.return_value = {"ETag": '"d41d8cd98f00b204e9800998ecf8427e"'}
+    no_manifest(mock_s3)
 
     success = handler.sync_bls()
     assert success
-    mock_s3.put_object.assert_called_once()
+    assert put_keys(mock_s3) == ["bls-data/pr.data.0.Current", handler.MANIFEST_KEY]
 
 # Test for Lambda main handler with both components succeeding
 @patch("lambda_fns.ingest.handler.sync_bls", return_value=True)
@@ -46,3 +74,889 @@ def test_main_success(mock_pop, mock_bls):
     body = json.loads(response["body"])
     assert body["bls_sync"] is True
     assert body["population_upload_success"] is True
+
+# Test that a failed transfer is reported without stopping the other files
+@patch("lambda_fns.ingest.handler.http.get")
+@patch("lambda_fns.ingest.handler.s3")
+def test_sync_bls_reports_failed_transfers(mock_s3, mock_get):
+    def get_side_effect(url, **kwargs):
+        response = MagicMock()
+        if url == handler.BLS_URL:
+            response.headers = {}
+            response.iter_content.return_value = [b"""
+            <html><body>
+            <a href="pr.data.0.Current">a</a>
+            <a href="pr.series">b</a>
+            </body></html>
+            """]
+        elif url.endswith("pr.series"):
+            response.raise_for_status.side_effect = Exception("503 Server Error")
+        else:
+            response.headers = {}
+            response.iter_content.return_value = [b"sample file content"]
+        return response
+
+    mock_get.side_effect = get_side_effect
+    mock_s3.get_paginator.return_value.paginate.return_value = []
+    mock_s3.put_object.return_value = {"ETag": '"etag"'}
+    no_manifest(mock_s3)
+
+    results, errors, _ = handler.run_transfers(handler.fetch_remote_files(), {})
+    assert results == {"pr.data.0.Current": "uploaded"}
+    assert list(errors) == ["pr.series"]
+
+    assert handler.sync_bls() is False
+
+# Test that a file is revalidated with its stored validators and skipped on 304
+@patch("lambda_fns.ingest.handler.http.get")
+@patch("lambda_fns.ingest.handler.s3")
+def test_sync_file_not_modified(mock_s3, mock_get):
+    mock_s3.head_object.return_value = {"Metadata": {
+        "origin-etag": '"abc123"',
+        "origin-last-modified": "Tue, 01 Jul 2025 12:00:00 GMT"
+    }}
+    mock_get.return_value.status_code = 304
+
+    action, entry = handler.sync_file(
+        "pr.data.0.Current", {"url": handler.BLS_URL + "pr.data.0.Current"},
+        {"bls-data/pr.data.0.Current": {"etag": "etag"}}
+    )
+    assert action == "unchanged"
+    assert entry["metadata"]["origin-etag"] == '"abc123"'
+    _, kwargs = mock_get.call_args
+    assert kwargs["headers"]["If-None-Match"] == '"abc123"'
+    assert kwargs["headers"]["If-Modified-Since"] == "Tue, 01 Jul 2025 12:00:00 GMT"
+    mock_s3.put_object.assert_not_called()
+
+# Test that the directory index columns are parsed and used to skip unchanged files
+@patch("lambda_fns.ingest.handler.SYNC_MODE", "listing")
+@patch("lambda_fns.ingest.handler.http.get")
+@patch("lambda_fns.ingest.handler.s3")
+def test_sync_bls_listing_mode(mock_s3, mock_get):
+    serve_bls_index(mock_get, """
+    <html><body><pre><A HREF="/pub/time.series/">[To Parent Directory]</A><br><br>
+     7/31/2025  8:30 AM        583826 <A HREF="/pub/time.series/pr/pr.data.0.Current">pr.data.0.Current</A><br>
+     1/15/2025  8:30 AM          420 <A HREF="/pub/time.series/pr/pr.txt">pr.txt</A><br>
+    </pre></body></html>
+    """)
+    remote = handler.fetch_remote_files()
+    assert set(remote) == {"pr.data.0.Current", "pr.txt"}
+    assert remote["pr.txt"]["url"] == "https://download.bls.gov/pub/time.series/pr/pr.txt"
+    assert remote["pr.data.0.Current"]["size"] == 583826
+    assert remote["pr.data.0.Current"]["mtime"].strftime("%Y-%m-%d %H:%M") == "2025-07-31 08:30"
+
+    uploaded = datetime(2025, 8, 1, tzinfo=timezone.utc)
+    s3_files = {
+        "bls-data/pr.data.0.Current": {"etag": "x", "size": 583826, "last_modified": uploaded},
+        "bls-data/pr.txt": {"etag": "y", "size": 420, "last_modified": uploaded},
+    }
+    mock_get.reset_mock()
+    results, errors, _ = handler.run_transfers(remote, s3_files)
+    assert results == {"pr.data.0.Current": "unchanged", "pr.txt": "unchanged"}
+    assert not errors
+    mock_get.assert_not_called()
+    mock_s3.head_object.assert_not_called()
+
+# Test that large bodies are streamed through a multipart upload part by part
+@patch("lambda_fns.ingest.handler.PART_SIZE", 8)
+@patch("lambda_fns.ingest.handler.s3")
+def test_stream_to_s3_multipart(mock_s3):
+    response = MagicMock()
+    response.iter_content.return_value = [b"0123456789", b"abcdefghij"]
+    mock_s3.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+    mock_s3.upload_part.side_effect = lambda **kwargs: {"ETag": f"etag-{kwargs['PartNumber']}"}
+
+    result = handler.stream_to_s3(response, "bls-data/big", {"origin-etag": "e"})
+    checksum = result["checksum"]
+    assert result["written"]
+    assert result["size"] == 20
+    part_digests = [hashlib.sha256(p).digest() for p in (b"01234567", b"89abcdef", b"ghij")]
+    composite = base64.b64encode(hashlib.sha256(b"".join(part_digests)).digest()).decode()
+    assert checksum == f"{composite}-3"
+    bodies = [kwargs["Body"] for _, kwargs in mock_s3.upload_part.call_args_list]
+    assert bodies == [b"01234567", b"89abcdef", b"ghij"]
+    _, kwargs = mock_s3.complete_multipart_upload.call_args
+    assert [p["PartNumber"] for p in kwargs["MultipartUpload"]["Parts"]] == [1, 2, 3]
+    mock_s3.put_object.assert_not_called()
+    response.close.assert_called_once()
+
+    # An identical body leaves the existing object in place, even though its
+    # multipart ETag is not an MD5 of the content
+    mock_s3.reset_mock()
+    existing = {"checksum": checksum, "etag": "d41d8cd98f00b204e9800998ecf8427e-3"}
+    result = handler.stream_to_s3(response, "bls-data/big", existing=existing)
+    assert not result["written"]
+    mock_s3.abort_multipart_upload.assert_called_once()
+    mock_s3.complete_multipart_upload.assert_not_called()
+
+# Test that objects uploaded before checksums were recorded compare by ETag
+def test_body_matches_legacy_etag():
+    md5 = hashlib.md5(b"body").hexdigest()
+    assert handler.body_matches({"etag": md5}, {"checksum"}, md5)
+    assert not handler.body_matches({"etag": f"{md5}-2"}, {"checksum"}, md5)
+    assert not handler.body_matches({"checksum": "other", "etag": md5}, {"checksum"}, md5)
+
+# Test that stale keys are deleted in DeleteObjects batches with per-key errors
+@patch("lambda_fns.ingest.handler.DELETE_BATCH_SIZE", 2)
+@patch("lambda_fns.ingest.handler.s3")
+def test_delete_s3_keys_batches(mock_s3):
+    def delete_side_effect(Bucket, Delete):
+        keys = [obj["Key"] for obj in Delete["Objects"]]
+        if "bls-data/c" in keys:
+            return {"Errors": [{"Key": "bls-data/c", "Code": "AccessDenied", "Message": "Access Denied"}]}
+        return {}
+
+    mock_s3.delete_objects.side_effect = delete_side_effect
+
+    errors = handler.delete_s3_keys(["bls-data/e", "bls-data/a", "bls-data/d", "bls-data/b", "bls-data/c"])
+    assert errors == {"bls-data/c": "AccessDenied: Access Denied"}
+    batches = sorted(
+        [obj["Key"] for obj in kwargs["Delete"]["Objects"]]
+        for _, kwargs in mock_s3.delete_objects.call_args_list
+    )
+    assert batches == [["bls-data/a", "bls-data/b"], ["bls-data/c", "bls-data/d"], ["bls-data/e"]]
+    mock_s3.delete_object.assert_not_called()
+
+# Test that a run driven by the manifest needs no listing and records new state
+@patch("lambda_fns.ingest.handler.http.get")
+@patch("lambda_fns.ingest.handler.s3")
+def test_sync_bls_uses_manifest(mock_s3, mock_get):
+    manifest = {
+        "version": handler.MANIFEST_VERSION,
+        "generation": 4,
+        "reconciled_at": datetime.now(timezone.utc).isoformat(),
+        "files": {
+            "pr.data.0.Current": {"etag": "e1", "size": 10, "checksum": "c1",
+                                  "metadata": {"origin-etag": '"v1"'}},
+            "pr.retired": {"etag": "e2", "size": 5, "checksum": "c2", "metadata": {}},
+        },
+    }
+    def get_object_side_effect(Bucket, Key):
+        if Key == handler.MANIFEST_KEY:
+            return {"Body": MagicMock(read=lambda: json.dumps(manifest).encode())}
+        raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+
+    mock_s3.get_object.side_effect = get_object_side_effect
+    mock_s3.delete_objects.return_value = {}
+    mock_get.return_value.status_code = 304
+    serve_bls_index(mock_get, """
+    <html><body><a href="pr.data.0.Current">Download</a></body></html>
+    """)
+
+    assert handler.sync_bls()
+    mock_s3.get_paginator.assert_not_called()
+    mock_s3.head_object.assert_not_called()
+    _, kwargs = mock_s3.delete_objects.call_args
+    assert kwargs["Delete"]["Objects"] == [{"Key": "bls-data/pr.retired"}]
+
+    _, kwargs = mock_s3.put_object.call_args
+    assert kwargs["Key"] == handler.MANIFEST_KEY
+    written = json.loads(kwargs["Body"])
+    assert written["generation"] == 5
+    assert list(written["files"]) == ["pr.data.0.Current"]
+    assert written["files"]["pr.data.0.Current"]["checksum"] == "c1"
+
+# Test that a sync out of time checkpoints its pending files and re-invokes itself
+@patch("lambda_fns.ingest.handler.boto3.client")
+@patch("lambda_fns.ingest.handler.http.get")
+@patch("lambda_fns.ingest.handler.s3")
+def test_sync_bls_checkpoints_before_timeout(mock_s3, mock_get, mock_client):
+    serve_bls_index(mock_get, """
+    <html><body><a href="pr.data.0.Current">a</a><a href="pr.series">b</a></body></html>
+    """)
+    mock_s3.get_paginator.return_value.paginate.return_value = []
+    no_manifest(mock_s3)
+    context = MagicMock()
+    context.get_remaining_time_in_millis.return_value = 1000
+    context.invoked_function_arn = "arn:aws:lambda:us-east-1:123456789012:function:ingest"
+
+    assert handler.sync_bls(context, resume_count=2)
+
+    _, kwargs = mock_s3.put_object.call_args
+    assert kwargs["Key"] == handler.CHECKPOINT_KEY
+    assert json.loads(kwargs["Body"])["pending"] == ["pr.data.0.Current", "pr.series"]
+    _, kwargs = mock_client.return_value.invoke.call_args
+    assert kwargs["InvocationType"] == "Event"
+    assert json.loads(kwargs["Payload"]) == {"resume": True, "resume_count": 3, "datasets": ["pr"]}
+
+# Test that only a resumed sync trusts an old checkpoint's completed files
+@patch("lambda_fns.ingest.handler.load_checkpoint")
+@patch("lambda_fns.ingest.handler.http.get")
+@patch("lambda_fns.ingest.handler.s3")
+def test_sync_bls_ignores_stale_checkpoint(mock_s3, mock_get, mock_load_checkpoint):
+    serve_bls_index(mock_get, """
+    <html><body><a href="pr.data.0.Current">a</a><a href="pr.series">b</a></body></html>
+    """)
+    mock_s3.get_paginator.return_value.paginate.return_value = []
+    no_manifest(mock_s3)
+    mock_get.return_value.iter_content.return_value = [b"data"]
+    mock_get.return_value.headers = {"ETag": '"v1"'}
+    mock_s3.put_object.return_value = {"ETag": '"8d777f385d3dfec8815d20f7496026dc"'}
+    mock_load_checkpoint.return_value = {
+        "created_at": "2020-01-01T00:00:00+00:00", "completed": ["pr.series"], "pending": [],
+    }
+
+    assert handler.sync_bls(resume_count=1)
+    downloaded = [args[0] for args, _ in mock_get.call_args_list if args[0] != handler.BLS_URL]
+    assert downloaded == [handler.BLS_URL + "pr.data.0.Current"]
+
+    mock_get.reset_mock()
+    assert handler.sync_bls()
+    downloaded = [args[0] for args, _ in mock_get.call_args_list if args[0] != handler.BLS_URL]
+    assert sorted(downloaded) == [handler.BLS_URL + "pr.data.0.Current", handler.BLS_URL + "pr.series"]
+    _, kwargs = mock_s3.delete_object.call_args
+    assert kwargs["Key"] == handler.CHECKPOINT_KEY
+
+# Test that a grown file is updated by copying the old object and uploading only the tail
+@patch("lambda_fns.ingest.handler.DELTA_SYNC", True)
+@patch("lambda_fns.ingest.handler.MIN_PART_SIZE", 4)
+@patch("lambda_fns.ingest.handler.DELTA_CHECK_BYTES", 4)
+@patch("lambda_fns.ingest.handler.http.get")
+@patch("lambda_fns.ingest.handler.s3")
+def test_sync_file_appends_tail(mock_s3, mock_get):
+    old, new = b"row1\nrow2\n", b"row1\nrow2\nrow3\n"
+
+    def get_side_effect(url, headers=None, **kwargs):
+        response = MagicMock()
+        response.status_code = 206
+        start, _, end = headers["Range"][len("bytes="):].partition("-")
+        end = int(end) if end else len(new) - 1
+        response.content = new[int(start):end + 1]
+        response.iter_content.return_value = [new[int(start):end + 1]]
+        response.headers = {"ETag": '"v2"', "Content-Range": f"bytes {start}-{end}/{len(new)}"}
+        return response
+
+    mock_get.side_effect = get_side_effect
+    mock_s3.get_object.return_value = {"Body": MagicMock(read=lambda: old[-4:])}
+    mock_s3.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+    mock_s3.upload_part_copy.return_value = {"CopyPartResult": {"ETag": '"p1"'}}
+    mock_s3.upload_part.return_value = {"ETag": '"p2"'}
+    mock_s3.complete_multipart_upload.return_value = {"ETag": '"whole-2"', "ChecksumSHA256": "c-2"}
+
+    remote = {"url": handler.BLS_URL + "pr.data.0.Current", "size": len(new), "mtime": None}
+    record = {"etag": "old", "size": len(old), "checksum": "c", "metadata": {"origin-etag": '"v1"'}}
+    action, entry = handler.sync_file("pr.data.0.Current", remote, {"bls-data/pr.data.0.Current": record})
+
+    assert action == "appended"
+    assert entry["size"] == len(new)
+    assert entry["metadata"]["origin-etag"] == '"v2"'
+    ranges = [kwargs["headers"]["Range"] for _, kwargs in mock_get.call_args_list]
+    assert ranges == ["bytes=6-9", "bytes=10-"]
+    assert all(kwargs.get("stream") for _, kwargs in mock_get.call_args_list)
+    _, kwargs = mock_s3.upload_part.call_args
+    assert kwargs["Body"] == b"row3\n"
+    assert kwargs["PartNumber"] == 2
+    mock_s3.put_object.assert_not_called()
+
+# Test that compressed mode stores gzip bytes with Content-Encoding: gzip
+@patch("lambda_fns.ingest.handler.COMPRESS_BLS", True)
+@patch("lambda_fns.ingest.handler.http.get")
+@patch("lambda_fns.ingest.handler.s3")
+def test_upload_file_to_s3_compressed(mock_s3, mock_get):
+    content = b"series_id\tyear\tperiod\tvalue\n" * 100
+    mock_get.return_value.headers = {}
+    mock_get.return_value.iter_content.return_value = [content]
+    mock_s3.put_object.return_value = {"ETag": '"etag"'}
+
+    entry = handler.upload_file_to_s3("pr.data.0.Current", {"url": handler.BLS_URL + "pr.data.0.Current"})
+
+    _, kwargs = mock_get.call_args
+    assert kwargs["headers"]["Accept-Encoding"] == "gzip"
+    _, kwargs = mock_s3.put_object.call_args
+    assert kwargs["ContentEncoding"] == "gzip"
+    assert gzip.decompress(kwargs["Body"]) == content
+    assert entry["encoding"] == "gzip"
+    assert entry["size"] == len(kwargs["Body"]) < len(content)
+
+# Test that listing records are emitted as links are read, even when split across chunks
+def test_iter_listing_streams_records():
+    page = (
+        b'<pre><A HREF="/pub/time.series/">[To Parent Directory]</A><br><br>'
+        b' 7/31/2025  8:30 AM        583826 <A HREF="/pub/time.series/pr/pr.data.0.Current">pr.data.0.Current</A><br>'
+        b' 3/28/2025  8:30 AM        &lt;dir&gt; <A HREF="/pub/time.series/pr/sub/">sub</A><br></pre>'
+    )
+    chunks = [page[i:i + 7] for i in range(0, len(page), 7)]
+    records = list(handler.iter_listing(chunks))
+    assert [href for href, _, _ in records] == [
+        "/pub/time.series/", "/pub/time.series/pr/pr.data.0.Current", "/pub/time.series/pr/sub/"
+    ]
+    assert records[1][1] == 583826
+    assert records[2][1:] == (None, None)
+
+# Test that the shared HTTP session pools keep-alive connections per host
+def test_http_session_pool():
+    adapter = handler.http.get_adapter(handler.BLS_URL)
+    assert adapter._pool_maxsize == handler.HTTP_POOL_SIZE
+    assert adapter._pool_block
+    assert handler.http.get_adapter(handler.POP_URL) is adapter
+
+# Test that the BLS sync and population load run concurrently and report separately
+@patch("lambda_fns.ingest.handler.load_population_to_s3")
+@patch("lambda_fns.ingest.handler.sync_bls")
+def test_main_runs_tasks_concurrently(mock_bls, mock_pop):
+    both_started = threading.Barrier(2, timeout=5)
+
+    def bls(*args):
+        both_started.wait()
+        return False
+
+    def pop():
+        both_started.wait()
+        return True
+
+    mock_bls.side_effect = bls
+    mock_pop.side_effect = pop
+
+    response = handler.main({}, {})
+    assert response["statusCode"] == 500
+    body = json.loads(response["body"])
+    assert body == {"bls_sync": False, "population_upload_success": True}
+
+# Test that throttled requests honor Retry-After and halve the host's concurrency
+@patch("lambda_fns.ingest.handler.time.sleep")
+@patch("lambda_fns.ingest.handler.http.get")
+def test_origin_get_retries_throttling(mock_get, mock_sleep):
+    throttled = MagicMock(status_code=429, headers={"Retry-After": "7"})
+    ok = MagicMock(status_code=200, headers={})
+    mock_get.side_effect = [throttled, ok]
+    limiter = handler.AdaptiveLimiter(8)
+
+    with patch.dict(handler.limiters, {"download.bls.gov": limiter}):
+        response = handler.origin_get(handler.BLS_URL + "pr.series")
+
+    assert response is ok
+    mock_sleep.assert_called_once_with(7.0)
+    throttled.close.assert_called_once()
+    assert 4 < limiter.limit < 5
+
+# Test that files waiting on a throttled host are not started after the deadline
+@patch("lambda_fns.ingest.handler.sync_file")
+def test_run_transfers_deadline_after_limiter(mock_sync_file):
+    def slow_sync(fname, remote, s3_files, prefix):
+        time.sleep(0.2)
+        return "uploaded", {"etag": fname}
+
+    mock_sync_file.side_effect = slow_sync
+    limiter = handler.AdaptiveLimiter(8)
+    limiter.limit = 1.0
+    remote = {f"f{i}": {"url": handler.BLS_URL + f"f{i}"} for i in range(4)}
+
+    with patch.dict(handler.limiters, {"download.bls.gov": limiter}):
+        results, errors, _ = handler.run_transfers(remote, {}, deadline=time.monotonic() + 0.1)
+
+    assert len(results) == 1
+    assert errors == {}
+    assert mock_sync_file.call_count == 1
+
+# Test that the adaptive limiter grows additively and never drops below one slot
+def test_adaptive_limiter_aimd():
+    limiter = handler.AdaptiveLimiter(maximum=4)
+    limiter.limit = 2.0
+    limiter.record("ok")
+    limiter.record("ok")
+    assert limiter.limit == pytest.approx(2.9, abs=0.01)
+    limiter.record("slow")
+    assert limiter.limit == pytest.approx(2.9, abs=0.01)
+    for _ in range(50):
+        limiter.record("ok")
+    assert limiter.limit == 4
+    for _ in range(5):
+        limiter._last_decrease = 0.0
+        limiter.record("throttled")
+    assert limiter.limit == 1
+
+# Test that a request slower than the recent latency percentile is hedged
+@patch("lambda_fns.ingest.handler.HEDGE_PERCENTILE", 90)
+@patch("lambda_fns.ingest.handler.HEDGE_MAX_RATIO", 1.0)
+@patch("lambda_fns.ingest.handler.http.get")
+def test_hedged_get_uses_fastest_response(mock_get):
+    slow, fast = MagicMock(name="slow"), MagicMock(name="fast")
+    release_slow = threading.Event()
+    calls = iter([slow, fast])
+
+    def get_side_effect(url, **kwargs):
+        response = next(calls)
+        if response is slow:
+            release_slow.wait(5)
+        return response
+
+    mock_get.side_effect = get_side_effect
+    tracker = handler.LatencyTracker()
+    for _ in range(handler.HEDGE_MIN_SAMPLES):
+        tracker.record(0.01)
+
+    with patch.dict(handler.latency_trackers, {"download.bls.gov": tracker}):
+        assert handler.hedged_get(handler.BLS_URL + "pr.series", stream=True) is fast
+        release_slow.set()
+        deadline = time.monotonic() + 5
+        while not slow.close.called and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    assert tracker.hedges == 1
+    slow.close.assert_called_once()
+    fast.close.assert_not_called()
+
+    # Requests that are not streamed, or go to another host, are not hedged
+    mock_get.side_effect = None
+    with patch.dict(handler.latency_trackers, {"download.bls.gov": tracker}):
+        handler.hedged_get(handler.BLS_URL + "pr.series")
+        handler.hedged_get(handler.POP_API_URL, stream=True)
+    assert tracker.requests == 1
+    assert len(tracker.samples) == handler.HEDGE_MIN_SAMPLES + 2
+
+# Test that the crawler follows subdirectories level by level and keeps relative paths
+@patch("lambda_fns.ingest.handler.CRAWL_MAX_DEPTH", 1)
+@patch("lambda_fns.ingest.handler.http.get")
+def test_fetch_remote_files_crawls_subdirectories(mock_get):
+    pages = {
+        handler.BLS_URL: b"""<pre>
+            <A HREF="/pub/time.series/">[To Parent Directory]</A><br>
+            <A HREF="/pub/time.series/pr/pr.series">pr.series</A><br>
+            <A HREF="/pub/time.series/pr/archive/">archive</A><br></pre>""",
+        handler.BLS_URL + "archive/": b"""<pre>
+            <A HREF="/pub/time.series/pr/">[To Parent Directory]</A><br>
+            <A HREF="/pub/time.series/pr/archive/pr.data.2019">pr.data.2019</A><br>
+            <A HREF="/pub/time.series/pr/archive/old/">old</A><br></pre>""",
+    }
+
+    def get_side_effect(url, **kwargs):
+        response = MagicMock(status_code=200, headers={})
+        response.iter_content.return_value = [pages[url]]
+        return response
+
+    mock_get.side_effect = get_side_effect
+
+    files = handler.fetch_remote_files()
+    assert sorted(files) == ["archive/pr.data.2019", "pr.series"]
+    assert files["archive/pr.data.2019"]["url"] == handler.BLS_URL + "archive/pr.data.2019"
+    requested = sorted(args[0] for args, _ in mock_get.call_args_list)
+    assert requested == [handler.BLS_URL, handler.BLS_URL + "archive/"]
+
+# Test that the dataset registry accepts survey codes or JSON and orders by priority
+def test_load_datasets():
+    datasets = handler.load_datasets("pr, ce")
+    assert [d["name"] for d in datasets] == ["ce", "pr"]
+    pr = datasets[1]
+    assert pr["url"] == handler.BLS_URL
+    assert pr["prefix"] == handler.BLS_PREFIX
+    assert pr["manifest_key"] == handler.MANIFEST_KEY
+    assert datasets[0]["prefix"] == "bls-data/ce/"
+
+    datasets = handler.load_datasets(json.dumps([
+        {"name": "la", "include": ["la.data.*"], "exclude": ["*.AllStatesS"]},
+        {"name": "cu", "priority": 5},
+    ]))
+    assert [d["name"] for d in datasets] == ["cu", "la"]
+    la = datasets[1]
+    assert handler.dataset_selects(la, "la.data.0.CurrentU")
+    assert not handler.dataset_selects(la, "la.series")
+    assert not handler.dataset_selects(la, "la.data.2.AllStatesS")
+
+    with pytest.raises(ValueError):
+        handler.load_datasets("pr,pr")
+
+# Test that several datasets sync in one run, each to its own prefix, without
+# the outer dataset deleting the files of a dataset nested under its prefix
+@patch("lambda_fns.ingest.handler.BLS_DATASETS", "pr,ce")
+@patch("lambda_fns.ingest.handler.http.get")
+@patch("lambda_fns.ingest.handler.s3")
+def test_sync_bls_multiple_datasets(mock_s3, mock_get):
+    ce_url = handler.BLS_SERIES_URL + "ce/"
+    pages = {
+        handler.BLS_URL: b'<a href="pr.series">pr.series</a>',
+        ce_url: b'<a href="ce.series">ce.series</a>',
+    }
+
+    def get_side_effect(url, **kwargs):
+        response = MagicMock(status_code=200, headers={})
+        response.iter_content.return_value = [pages.get(url, b"data")]
+        return response
+
+    mock_get.side_effect = get_side_effect
+    no_manifest(mock_s3)
+    mock_s3.put_object.return_value = {"ETag": '"e"'}
+    mock_s3.get_paginator.return_value.paginate.side_effect = lambda Bucket, Prefix: [{"Contents": [
+        {"Key": key, "ETag": '"old"', "Size": 4, "LastModified": datetime.now(timezone.utc)}
+        for key in ["bls-data/old.file", "bls-data/ce/ce.series"] if key.startswith(Prefix)
+    ]}]
+
+    assert handler.sync_bls()
+
+    keys = put_keys(mock_s3)
+    assert "bls-data/pr.series" in keys
+    assert "bls-data/ce/ce.series" in keys
+    assert "_sync/bls-data/manifest.json" in keys
+    assert "_sync/bls-data/ce/manifest.json" in keys
+    _, kwargs = mock_s3.delete_objects.call_args
+    assert kwargs["Delete"]["Objects"] == [{"Key": "bls-data/old.file"}]
+
+# Test that removing a dataset from the registry leaves its files in place
+@patch("lambda_fns.ingest.handler.RECONCILE_HOURS", 0)
+@patch("lambda_fns.ingest.handler.http.get")
+@patch("lambda_fns.ingest.handler.s3")
+def test_sync_bls_removed_dataset_kept(mock_s3, mock_get):
+    ce_url = handler.BLS_SERIES_URL + "ce/"
+    pages = {
+        handler.BLS_URL: b'<a href="pr.series">pr.series</a>',
+        ce_url: b'<a href="ce.series">ce.series</a>',
+    }
+
+    def get_side_effect(url, **kwargs):
+        response = MagicMock(status_code=200, headers={})
+        response.iter_content.return_value = [pages.get(url, b"data")]
+        return response
+
+    mock_get.side_effect = get_side_effect
+    objects = fake_bucket(mock_s3)
+    with patch("lambda_fns.ingest.handler.BLS_DATASETS", "pr,ce"):
+        assert handler.sync_bls()
+    assert "bls-data/ce/ce.series" in objects
+
+    with patch("lambda_fns.ingest.handler.BLS_DATASETS", "pr"):
+        assert handler.sync_bls()
+    assert "bls-data/ce/ce.series" in objects
+    assert "bls-data/pr.series" in objects
+    assert list(json.loads(objects[handler.MANIFEST_KEY])["files"]) == ["pr.series"]
+
+def fake_bucket(mock_s3):
+    """Helper backing the mocked s3 client's object calls with a dict"""
+    objects = {}
+
+    def etag(Key):
+        return '"' + hashlib.md5(objects[Key]).hexdigest() + '"'
+
+    def put_object(Bucket, Key, Body, IfNoneMatch=None, IfMatch=None, **kwargs):
+        if (IfNoneMatch == "*" and Key in objects) or (IfMatch and (Key not in objects or etag(Key) != IfMatch)):
+            raise ClientError({"Error": {"Code": "PreconditionFailed"}}, "PutObject")
+        objects[Key] = Body.encode("utf-8") if isinstance(Body, str) else Body
+        return {"ETag": etag(Key)}
+
+    def get_object(Bucket, Key, **kwargs):
+        if Key not in objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return {"Body": io.BytesIO(objects[Key]), "ETag": etag(Key)}
+
+    def head_object(Bucket, Key, **kwargs):
+        if Key not in objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {"ETag": etag(Key), "Metadata": {}}
+
+    def copy_object(Bucket, Key, CopySource, **kwargs):
+        objects[Key] = objects[CopySource["Key"]]
+        return {"CopyObjectResult": {"ETag": etag(Key)}}
+
+    def paginate(Bucket, Prefix):
+        return [{"Contents": [
+            {"Key": key, "ETag": etag(key), "Size": len(body), "LastModified": datetime.now(timezone.utc)}
+            for key, body in sorted(objects.items()) if key.startswith(Prefix)
+        ]}]
+
+    def delete_objects(Bucket, Delete):
+        for obj in Delete["Objects"]:
+            objects.pop(obj["Key"], None)
+        return {}
+
+    def delete_object(Bucket, Key):
+        objects.pop(Key, None)
+        return {}
+
+    mock_s3.put_object.side_effect = put_object
+    mock_s3.get_object.side_effect = get_object
+    mock_s3.head_object.side_effect = head_object
+    mock_s3.copy_object.side_effect = copy_object
+    mock_s3.get_paginator.return_value.paginate.side_effect = paginate
+    mock_s3.delete_objects.side_effect = delete_objects
+    mock_s3.delete_object.side_effect = delete_object
+    return objects
+
+# Test that shards are balanced by total size
+def test_shard_files_balances_sizes():
+    remote = {f"f{i}": {"url": "u", "size": size} for i, size in enumerate([90, 50, 40, 30, 20, 10])}
+    shards = handler.shard_files(remote, 2)
+    assert sorted(sum(r["size"] for r in shard.values()) for shard in shards) == [120, 120]
+    assert len(handler.shard_files(remote, 10)) == 6
+
+# Test that the coordinator queues shards, and the worker finishing the last one commits the run
+@patch("lambda_fns.ingest.handler.SYNC_QUEUE_URL", "https://sqs.example/queue")
+@patch("lambda_fns.ingest.handler.FANOUT_MIN_FILES", 1)
+@patch("lambda_fns.ingest.handler.SYNC_SHARDS", 2)
+@patch("lambda_fns.ingest.handler.boto3.client")
+@patch("lambda_fns.ingest.handler.http.get")
+@patch("lambda_fns.ingest.handler.s3")
+def test_sync_bls_fans_out_to_workers(mock_s3, mock_get, mock_client):
+    serve_bls_index(mock_get, """
+    <pre>7/31/2025  8:30 AM  600 <a href="pr.data.0.Current">a</a>
+    7/31/2025  8:30 AM  500 <a href="pr.series">b</a>
+    7/31/2025  8:30 AM  100 <a href="pr.txt">c</a></pre>
+    """)
+    mock_get.return_value.headers = {}
+    mock_get.return_value.iter_content.return_value = [b"data"]
+    objects = fake_bucket(mock_s3)
+    objects["bls-data/removed.file"] = b"old"
+    mock_client.return_value.send_message_batch.return_value = {}
+
+    assert handler.sync_bls()
+
+    _, kwargs = mock_client.return_value.send_message_batch.call_args
+    messages = [json.loads(entry["MessageBody"]) for entry in kwargs["Entries"]]
+    assert [m["shard"] for m in messages] == [0, 1]
+    assert handler.MANIFEST_KEY not in objects
+
+    records = [{"messageId": str(i), "body": json.dumps(m)} for i, m in enumerate(messages)]
+    assert handler.worker({"Records": records[:1]}, None) == {"batchItemFailures": []}
+    assert handler.MANIFEST_KEY not in objects
+    assert handler.worker({"Records": records[1:]}, None) == {"batchItemFailures": []}
+
+    manifest = json.loads(objects[handler.MANIFEST_KEY])
+    assert sorted(manifest["files"]) == ["pr.data.0.Current", "pr.series", "pr.txt"]
+    assert "bls-data/removed.file" not in objects
+    assert not [key for key in objects if key.startswith("_sync/bls-data/runs/")]
+
+    # A redelivered shard of a committed run is skipped
+    assert handler.process_shard(messages[0]) is False
+
+# Test that a failed commit releases its claim, so the redelivered shard commits the run
+@patch("lambda_fns.ingest.handler.SYNC_QUEUE_URL", "https://sqs.example/queue")
+@patch("lambda_fns.ingest.handler.FANOUT_MIN_FILES", 1)
+@patch("lambda_fns.ingest.handler.SYNC_SHARDS", 2)
+@patch("lambda_fns.ingest.handler.boto3.client")
+@patch("lambda_fns.ingest.handler.http.get")
+@patch("lambda_fns.ingest.handler.s3")
+def test_fan_out_commit_retried_after_failure(mock_s3, mock_get, mock_client):
+    serve_bls_index(mock_get, """
+    <html><body><a href="pr.data.0.Current">a</a><a href="pr.series">b</a></body></html>
+    """)
+    mock_get.return_value.headers = {}
+    mock_get.return_value.iter_content.return_value = [b"data"]
+    objects = fake_bucket(mock_s3)
+    mock_client.return_value.send_message_batch.return_value = {}
+
+    assert handler.sync_bls()
+    _, kwargs = mock_client.return_value.send_message_batch.call_args
+    records = [{"messageId": entry["Id"], "body": entry["MessageBody"]} for entry in kwargs["Entries"]]
+    assert handler.worker({"Records": records[:1]}, None) == {"batchItemFailures": []}
+
+    failure = ClientError({"Error": {"Code": "InternalError"}}, "PutObject")
+    with patch("lambda_fns.ingest.handler.save_manifest", side_effect=failure):
+        response = handler.worker({"Records": records[1:]}, None)
+    assert response == {"batchItemFailures": [{"itemIdentifier": records[1]["messageId"]}]}
+    assert not [key for key in objects if key.endswith("/commit.json")]
+
+    assert handler.worker({"Records": records[1:]}, None) == {"batchItemFailures": []}
+    assert sorted(json.loads(objects[handler.MANIFEST_KEY])["files"]) == ["pr.data.0.Current", "pr.series"]
+    assert not [key for key in objects if key.startswith("_sync/bls-data/runs/")]
+
+# Test the state machine task bodies: plan stores runs, shards defer the commit to its own step
+@patch("lambda_fns.ingest.handler.SYNC_SHARDS", 2)
+@patch("lambda_fns.ingest.handler.http.get")
+@patch("lambda_fns.ingest.handler.s3")
+def test_step_functions_tasks(mock_s3, mock_get):
+    serve_bls_index(mock_get, """
+    <html><body><a href="pr.data.0.Current">a</a><a href="pr.series">b</a></body></html>
+    """)
+    mock_get.return_value.headers = {}
+    mock_get.return_value.iter_content.return_value = [b"data"]
+    objects = fake_bucket(mock_s3)
+
+    plan = handler.main({"step": "plan"}, None)
+    assert len(plan["runs"]) == 1
+    assert [item["shard"] for item in plan["shards"]] == [0, 1]
+
+    for item in plan["shards"]:
+        assert handler.worker(item, None) == {"processed": True}
+    assert handler.MANIFEST_KEY not in objects
+
+    assert handler.main({"step": "commit", "runs": plan["runs"]}, None) == {"ok": True}
+    assert sorted(json.loads(objects[handler.MANIFEST_KEY])["files"]) == ["pr.data.0.Current", "pr.series"]
+
+    with patch("lambda_fns.ingest.handler.load_population_to_s3", return_value=False):
+        with pytest.raises(RuntimeError):
+            handler.main({"step": "population"}, None)
+
+# Test that snapshots store each distinct body once and move the latest pointer
+@patch("lambda_fns.ingest.handler.SNAPSHOTS", True)
+@patch("lambda_fns.ingest.handler.http.get")
+@patch("lambda_fns.ingest.handler.s3")
+def test_sync_bls_snapshots(mock_s3, mock_get):
+    serve_bls_index(mock_get, """
+    <html><body><a href="pr.data.0.Current">a</a><a href="pr.series">b</a></body></html>
+    """)
+    mock_get.return_value.headers = {}
+    mock_get.return_value.status_code = 200
+    mock_get.return_value.iter_content.return_value = [b"same body"]
+    objects = fake_bucket(mock_s3)
+
+    assert handler.sync_bls()
+    latest = json.loads(objects["bls-snapshots/pr/latest.json"])
+    first = json.loads(objects[latest["snapshot"]])
+    digest = hashlib.sha256(b"same body").hexdigest()
+    assert first["files"] == {"pr.data.0.Current": digest, "pr.series": digest}
+    blobs = [key for key in objects if key.startswith("bls-snapshots/objects/")]
+    assert blobs == [handler.snapshot_blob_key(digest)]
+
+    # An unchanged second run adds a snapshot manifest but no new objects
+    mock_get.return_value.status_code = 304
+    mock_s3.copy_object.reset_mock()
+    assert handler.sync_bls()
+    latest = json.loads(objects["bls-snapshots/pr/latest.json"])
+    assert json.loads(objects[latest["snapshot"]])["files"] == first["files"]
+    mock_s3.copy_object.assert_not_called()
+
+    # Digests read back from S3 are saved in the manifest and not read again
+    manifest = json.loads(objects[handler.MANIFEST_KEY])
+    for entry in manifest["files"].values():
+        entry["sha256"] = entry["checksum"] = None
+    objects[handler.MANIFEST_KEY] = json.dumps(manifest).encode("utf-8")
+    assert handler.sync_bls()
+    files = json.loads(objects[handler.MANIFEST_KEY])["files"]
+    assert {entry["sha256"] for entry in files.values()} == {digest}
+    mock_s3.get_object.reset_mock()
+    assert handler.sync_bls()
+    read = [kwargs["Key"] for _, kwargs in mock_s3.get_object.call_args_list]
+    assert not [key for key in read if key.startswith("bls-data/")]
+
+    # A pointer to an expired snapshot manifest is still moved
+    expired = json.loads(objects["bls-snapshots/pr/latest.json"])["snapshot"]
+    del objects[expired]
+    assert handler.sync_bls()
+    assert json.loads(objects["bls-snapshots/pr/latest.json"])["snapshot"] != expired
+
+# Test that identical population data (in any key order) is not uploaded again
+@patch.dict("lambda_fns.ingest.handler.population_cache", clear=True)
+@patch("lambda_fns.ingest.handler.POP_CACHE_TTL_SECONDS", 0)
+@patch("lambda_fns.ingest.handler.http.get")
+@patch("lambda_fns.ingest.handler.s3")
+def test_load_population_to_s3_unchanged(mock_s3, mock_get):
+    no_manifest(mock_s3)
+    mock_get.return_value.status_code = 200
+    mock_get.return_value.content = b'{"data": [{"Year": 2020, "Population": 1}], "source": []}'
+    mock_s3.head_object.return_value = {"Metadata": {
+        "content-sha256": handler.canonical_hash({"source": [], "data": [{"Population": 1, "Year": 2020}]})
+    }}
+
+    assert handler.load_population_to_s3()
+    assert handler.POP_S3_KEY not in put_keys(mock_s3)
+
+    mock_get.return_value.content = b'{"data": [{"Year": 2021, "Population": 2}], "source": []}'
+    assert handler.load_population_to_s3()
+    _, kwargs = mock_s3.put_object.call_args
+    assert kwargs["Body"] == mock_get.return_value.content
+    assert kwargs["Metadata"]["content-sha256"] == handler.canonical_hash(json.loads(kwargs["Body"]))
+
+# Test that drilldowns are paged concurrently and streamed to S3 as NDJSON parts
+@patch("lambda_fns.ingest.handler.POP_GEOGRAPHIES", ["State"])
+@patch("lambda_fns.ingest.handler.POP_PAGE_SIZE", 2)
+@patch("lambda_fns.ingest.handler.PART_SIZE", 16)
+@patch("lambda_fns.ingest.handler.CHUNK_SIZE", 8)
+@patch.dict("lambda_fns.ingest.handler.population_cache", clear=True)
+@patch("lambda_fns.ingest.handler.http.get")
+@patch("lambda_fns.ingest.handler.s3")
+def test_load_population_geographies(mock_s3, mock_get):
+    no_manifest(mock_s3)
+    states = [{"Year": 2020, "State": f"S{i}", "Population": i} for i in range(5)]
+
+    def get_side_effect(url, **kwargs):
+        response = MagicMock(status_code=200, headers={})
+        if url == handler.POP_URL:
+            response.content = b'{"data": []}'
+            return response
+        assert "drilldowns=Year%2CState" in url
+        offset = int(url.rsplit("%2C", 1)[1])
+        response.json.return_value = {"data": states[offset:offset + 2], "page": {"total": 5}}
+        return response
+
+    mock_get.side_effect = get_side_effect
+    mock_s3.head_object.side_effect = ClientError({"Error": {"Code": "404"}}, "HeadObject")
+    mock_s3.create_multipart_upload.return_value = {"UploadId": "u"}
+    mock_s3.upload_part.return_value = {"ETag": '"p"'}
+    mock_s3.complete_multipart_upload.return_value = {"ETag": '"e-2"'}
+    mock_s3.put_object.return_value = {"ETag": '"e"'}
+
+    assert handler.load_population_to_s3()
+
+    _, kwargs = mock_s3.create_multipart_upload.call_args
+    assert kwargs["Key"] == "datausa/population/state.ndjson"
+    assert kwargs["ContentType"] == "application/x-ndjson"
+    body = b"".join(kwargs["Body"] for _, kwargs in mock_s3.upload_part.call_args_list)
+    assert [json.loads(line) for line in body.splitlines()] == states
+    requested = sorted(args[0] for args, _ in mock_get.call_args_list if args[0] != handler.POP_URL)
+    assert len(requested) == 3
+
+# Test that Parquet copies are typed, trimmed and only rebuilt for a new source version
+@patch("lambda_fns.ingest.handler.s3")
+def test_materialize_parquet(mock_s3):
+    pd = pytest.importorskip("pandas")
+    pytest.importorskip("pyarrow")
+    mock_s3.head_object.side_effect = ClientError({"Error": {"Code": "404"}}, "HeadObject")
+    body = b"series_id        \tyear\tperiod\t       value\tfootnote_codes\nPRS30006011       \t1995\tQ01\t          2.6\t\n"
+
+    assert handler.materialize_parquet("bls-data/pr.data.0.Current", "etag1", handler.bls_frame, body=body)
+    _, kwargs = mock_s3.put_object.call_args
+    assert kwargs["Key"] == "parquet/bls-data/pr.data.0.Current.parquet"
+    assert kwargs["Metadata"] == {"source-tag": "etag1"}
+    df = pd.read_parquet(io.BytesIO(kwargs["Body"]))
+    assert list(df.columns) == ["series_id", "year", "period", "value", "footnote_codes"]
+    assert df["series_id"][0] == "PRS30006011"
+    assert str(df["year"].dtype) == "int32" and df["value"][0] == 2.6
+
+    mock_s3.head_object.side_effect = None
+    mock_s3.head_object.return_value = {"Metadata": {"source-tag": "etag1"}}
+    mock_s3.put_object.reset_mock()
+    assert not handler.materialize_parquet("bls-data/pr.data.0.Current", "etag1", handler.bls_frame, body=body)
+    mock_s3.put_object.assert_not_called()
+
+# Test that a stale cached population response is revalidated conditionally,
+# and served as is when the API is slow or failing
+@patch.dict("lambda_fns.ingest.handler.population_cache", clear=True)
+@patch("lambda_fns.ingest.handler.POP_REFRESH_WAIT_SECONDS", 0.05)
+@patch("lambda_fns.ingest.handler.HTTP_RETRIES", 0)
+@patch("lambda_fns.ingest.handler.http.get")
+@patch("lambda_fns.ingest.handler.s3")
+def test_population_body_stale_while_revalidate(mock_s3, mock_get):
+    cached = {"body": b'{"data": []}', "etag": '"v1"', "last_modified": None, "fetched_at": time.time()}
+    handler.population_cache.update(cached)
+
+    # Fresh: no request at all
+    assert handler.population_body() == cached["body"]
+    mock_get.assert_not_called()
+
+    # Stale and not modified: conditional GET, cached body kept with a new fetch time
+    handler.population_cache["fetched_at"] = 0
+    mock_get.return_value.status_code = 304
+    assert handler.population_body() == cached["body"]
+    _, kwargs = mock_get.call_args
+    assert kwargs["headers"]["If-None-Match"] == '"v1"'
+    assert kwargs["timeout"] == handler.POP_TIMEOUT
+    assert handler.population_cache["fetched_at"] > 0
+
+    # Stale and the API hangs: the cached body is served without waiting for it
+    handler.population_cache["fetched_at"] = 0
+    release = threading.Event()
+    mock_get.side_effect = lambda url, **kwargs: release.wait(5) and None
+    started = time.monotonic()
+    assert handler.population_body() == cached["body"]
+    assert time.monotonic() - started < 1
+    release.set()
+    handler.population_refresh.exception(timeout=5)
+
+    # Stale and the API fails: the cached body is served
+    handler.population_cache["fetched_at"] = 0
+    mock_get.side_effect = handler.requests.ConnectionError("down")
+    assert handler.population_body() == cached["body"]
+
+# Test that a failing Parquet copy does not hold up the raw population upload
+@patch.dict("lambda_fns.ingest.handler.population_cache", clear=True)
+@patch("lambda_fns.ingest.handler.PARQUET", True)
+@patch("lambda_fns.ingest.handler.http.get")
+@patch("lambda_fns.ingest.handler.s3")
+def test_load_population_to_s3_parquet_failure(mock_s3, mock_get):
+    pytest.importorskip("pandas")
+    pytest.importorskip("pyarrow")
+    no_manifest(mock_s3)
+    mock_s3.head_object.side_effect = ClientError({"Error": {"Code": "404"}}, "HeadObject")
+    mock_get.return_value.status_code = 200
+    mock_get.return_value.content = b'{"data": [{"Nation": "US", "Year": null, "Population": 1}]}'
+
+    assert handler.load_population_to_s3()
+    assert handler.POP_S3_KEY in put_keys(mock_s3)
+    assert handler.parquet_key(handler.POP_S3_KEY) not in put_keys(mock_s3)
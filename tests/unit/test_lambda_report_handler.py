@@ -1,7 +1,9 @@
+import gzip
 import json
 import os
 import pytest
 import pandas as pd
+from botocore.exceptions import ClientError
 from unittest.mock import patch, MagicMock
 from io import BytesIO
 
@@ -34,6 +36,8 @@ def test_main_function(mock_get_object):
 
     # Side effect for mocking s3.get_object()
     def side_effect(Bucket, Key):
+        if Key.endswith(".parquet"):
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
         if "pr.data" in Key:
             return mock_s3_get_object(Key, pr_csv)
         elif "acs_population" in Key:
@@ -55,4 +59,53 @@ def test_main_function(mock_get_object):
     series_data = body["series_population_data"]
     assert len(series_data) == 2
     assert any(d["series_id"] == "PRS30006032" for d in series_data)
-    assert any(d["period"] == "Q01" for d in series_data)
\ No newline at end of file
+    assert any(d["period"] == "Q01" for d in series_data)
+
+# Test that gzip-encoded objects written by the ingest Lambda are read transparently
+@patch("lambda_fns.report.handler.s3.get_object")
+def test_read_s3_body_gzip(mock_get_object):
+    content = b"series_id\tyear\nPRS30006032\t2018\n"
+    mock_get_object.return_value = {
+        'Body': BytesIO(gzip.compress(content)),
+        'ContentEncoding': 'gzip'
+    }
+    assert handler.read_s3_body(handler.PR_KEY) == content
+
+# Test that a current Parquet copy is read instead of the raw object, and a stale one is not
+@patch("lambda_fns.report.handler.s3")
+def test_read_parquet_checks_source_version(mock_s3):
+    buffer = BytesIO()
+    pd.DataFrame({"series_id": ["PRS30006032"], "year": [2018], "period": ["Q01"], "value": [1.5]}).to_parquet(buffer)
+    mock_s3.get_object.side_effect = lambda Bucket, Key: {
+        "Body": BytesIO(buffer.getvalue()), "Metadata": {"source-tag": "etag1"}
+    }
+    mock_s3.head_object.return_value = {"ETag": '"etag1"', "Metadata": {}}
+
+    df = handler.read_parquet(handler.PR_KEY, columns=["series_id", "year"])
+    assert list(df.columns) == ["series_id", "year"]
+    _, kwargs = mock_s3.get_object.call_args
+    assert kwargs["Key"] == "parquet/bls-data/pr.data.0.Current.parquet"
+
+    mock_s3.head_object.return_value = {"ETag": '"etag2"', "Metadata": {}}
+    assert handler.read_parquet(handler.PR_KEY) is None
+
+# Test that prefix-sum population stats match pandas for any year window
+def test_population_stats_windows():
+    pop_df = pd.DataFrame({
+        "year": [2019, 2013, 2014, 2015, 2016, 2017, 2018, 2011],
+        "population": [328239523, 316128839, 318857056, 321418821, 323127515, 325719178, 327167439, 311556874],
+    })
+    stats = handler.PopulationStats.from_frame(pop_df)
+    for start, end in [(2013, 2018), (2000, 2030), (2012, 2012), (2015, 2016), (2011, 2011), (2019, 2013)]:
+        window = pop_df[(pop_df["year"] >= start) & (pop_df["year"] <= end)]["population"]
+        count, mean, std = stats.window(start, end)
+        assert count == len(window)
+        if count:
+            assert mean == pytest.approx(window.mean())
+        if count > 1:
+            assert std == pytest.approx(window.std())
+        else:
+            assert std is None
+
+    # Built once per population version
+    assert handler.population_stats(pop_df, "v1") is handler.population_stats(pop_df.iloc[:0], "v1")
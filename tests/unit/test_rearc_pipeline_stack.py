@@ -1,3 +1,4 @@
+import json
 import pytest
 import aws_cdk as cdk
 from aws_cdk.assertions import Template, Match
@@ -37,5 +38,81 @@ def test_stack_resources(environment, expected_bucket_name):
         "ScheduleExpression": "rate(1 day)"
     })
 
-    # Check Lambda Event Source Mapping exists
-    template.resource_count_is("AWS::Lambda::EventSourceMapping", 1)
\ No newline at end of file
+    # Check Lambda Event Source Mappings exist for the report and the sync workers
+    template.resource_count_is("AWS::Lambda::EventSourceMapping", 2)
+
+    # Check the ingest Lambdas write Parquet copies with the pandas layer attached
+    ingest_lambdas = template.find_resources("AWS::Lambda::Function", Match.object_like({
+        "Properties": {"Environment": {"Variables": {"PARQUET": "true"}}}
+    }))
+    assert len(ingest_lambdas) == 2
+    for resource in ingest_lambdas.values():
+        assert len(resource["Properties"]["Layers"]) == 2
+
+    # Check every function importing pandas has room for it beyond the 128 MB default
+    for resource in template.find_resources("AWS::Lambda::Function").values():
+        if len(resource["Properties"].get("Layers", [])) == 2:
+            assert resource["Properties"]["MemorySize"] >= 512
+
+    # Check the fan-out worker consumes one shard at a time from its queue
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "handler.worker"
+    })
+    template.has_resource_properties("AWS::Lambda::EventSourceMapping", {
+        "BatchSize": 1,
+        "FunctionResponseTypes": ["ReportBatchItemFailures"]
+    })
+    template.has_resource_properties("AWS::SQS::Queue", {
+        "RedrivePolicy": Match.object_like({"maxReceiveCount": 3})
+    })
+
+    # Check the ingest Lambda may re-invoke itself to resume a sync
+    template.has_resource_properties("AWS::IAM::Policy", {
+        "PolicyDocument": {
+            "Statement": Match.array_with([
+                Match.object_like({"Action": "lambda:InvokeFunction"})
+            ])
+        }
+    })
+
+def test_stack_step_functions():
+    app = cdk.App()
+    stack = RearcPipelineStack(app, "sfn-Test", environment="prod", use_step_functions=True, map_max_concurrency=4)
+    template = Template.from_stack(stack)
+
+    # Check the schedule starts the state machine instead of the ingest Lambda
+    template.resource_count_is("AWS::StepFunctions::StateMachine", 1)
+    template.has_resource_properties("AWS::Events::Rule", {
+        "Targets": Match.array_with([
+            Match.object_like({"Arn": {"Ref": Match.string_like_regexp("IngestReportStateMachine")}})
+        ])
+    })
+
+    # Only the shard queue drives a Lambda; the report runs as a state machine task
+    template.resource_count_is("AWS::Lambda::EventSourceMapping", 1)
+
+    state_machine = next(iter(template.find_resources("AWS::StepFunctions::StateMachine").values()))
+    definition = json.loads("".join(
+        part if isinstance(part, str) else "ARN"
+        for part in state_machine["Properties"]["DefinitionString"]["Fn::Join"][1]
+    ))
+    assert definition["StartAt"] == "Ingest"
+    assert definition["States"]["Ingest"]["Next"] == "RunReport"
+
+    plan_branch, population_branch = definition["States"]["Ingest"]["Branches"]
+    assert plan_branch["States"]["PlanBlsSync"]["Next"] == "SyncBlsShards"
+    shards_map = plan_branch["States"]["SyncBlsShards"]
+    assert shards_map["Type"] == "Map"
+    assert shards_map["MaxConcurrency"] == 4
+    assert shards_map["ItemsPath"] == "$.plan.shards"
+    assert shards_map["Next"] == "CommitBlsSync"
+    assert population_branch["StartAt"] == "LoadPopulation"
+
+    # Check every task has a timeout and a retry on task failures
+    tasks = [shards_map["ItemProcessor"]["States"]["SyncBlsShard"], definition["States"]["RunReport"]]
+    tasks += [state for branch in (plan_branch, population_branch)
+              for state in branch["States"].values() if state["Type"] == "Task"]
+    assert len(tasks) == 5
+    for task in tasks:
+        assert task["TimeoutSeconds"] > 0
+        assert any("States.TaskFailed" in retry["ErrorEquals"] for retry in task["Retry"])